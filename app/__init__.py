@@ -2,6 +2,7 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_migrate import Migrate
+import click
 import os
 
 db = SQLAlchemy()
@@ -29,6 +30,9 @@ def create_app():
     login_manager.init_app(app)
     migrate.init_app(app, db)
     
+    from app.utils.live_stats import live_stats
+    live_stats.init_app(app)
+    
     # Configure login manager
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Please log in to access this page.'
@@ -60,9 +64,18 @@ def create_app():
     app.register_blueprint(reports_bp)
     app.register_blueprint(main_bp)
     
+    @app.cli.command('refresh-stats')
+    def refresh_stats_command():
+        """Recompute medication sales velocity and customer RFM segments; run daily from cron"""
+        from app.utils.analytics import refresh_medication_sales_stats, compute_rfm_segments
+        updated = refresh_medication_sales_stats()
+        counts = compute_rfm_segments()
+        click.echo(f'Updated sales stats of {updated} medications; segmented {sum(counts.values())} customers.')
+    
     # Create tables and admin user
     with app.app_context():
-        db.create_all()
+        from app.utils.schema import ensure_schema
+        ensure_schema()
         from app.utils.helpers import create_admin_user
         create_admin_user()
     
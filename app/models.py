@@ -5,6 +5,9 @@ from sqlalchemy import func, and_, or_
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_row_version', 'row_version'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -15,6 +18,10 @@ class User(UserMixin, db.Model):
     is_active = db.Column(db.Boolean, default=False, nullable=False)
     is_approved = db.Column(db.Boolean, default=False, nullable=False)
     
+    # Id of the last transaction that changed the row, stamped by a trigger
+    # (see ensure_change_tracking) so incremental backups can find changes
+    row_version = db.Column(db.BigInteger, nullable=True)
+    
     def set_password(self, password, method='pbkdf2:sha256'):
         self.password_hash = generate_password_hash(password, method=method)
     
@@ -33,6 +40,10 @@ class User(UserMixin, db.Model):
 # Define models
 class Medication(db.Model):
     __tablename__ = 'medications'
+    __table_args__ = (
+        db.Index('ix_medications_last_sold_at', 'last_sold_at'),
+        db.Index('ix_medications_row_version', 'row_version'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -47,6 +58,13 @@ class Medication(db.Model):
     created_at = db.Column(db.DateTime, server_default=func.now())
     deleted = db.Column(db.Boolean, default=False, nullable=False)
     
+    # Sales velocity, bumped at checkout and re-based by refresh_medication_sales_stats
+    last_sold_at = db.Column(db.DateTime, nullable=True, info={'derived': True})
+    units_sold_30d = db.Column(db.Integer, default=0, server_default='0', nullable=False, info={'derived': True})
+    units_sold_90d = db.Column(db.Integer, default=0, server_default='0', nullable=False, info={'derived': True})
+    
+    row_version = db.Column(db.BigInteger, nullable=True)
+    
     # Relationship to sale items
     sale_items = db.relationship('SaleItem', backref='medication', lazy=True)
 
@@ -55,6 +73,11 @@ class Medication(db.Model):
 
 class Customer(db.Model):
     __tablename__ = 'customers'
+    __table_args__ = (
+        db.Index('ix_customers_phone_digits', 'phone_digits', postgresql_ops={'phone_digits': 'text_pattern_ops'}),
+        db.Index('ix_customers_rfm_segment', 'rfm_segment'),
+        db.Index('ix_customers_row_version', 'row_version'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -63,14 +86,44 @@ class Customer(db.Model):
     address = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, server_default=func.now())
     
+    # Phone with punctuation and spaces stripped, maintained by the database
+    phone_digits = db.Column(db.String(20), db.Computed("regexp_replace(phone, '[^0-9]', '', 'g')", persisted=True))
+    
+    # Recency/frequency/monetary scores (e.g. '545') and segment, set by compute_rfm_segments
+    rfm_score = db.Column(db.String(3), nullable=True, info={'derived': True})
+    rfm_segment = db.Column(db.String(30), nullable=True, info={'derived': True})
+    
+    row_version = db.Column(db.BigInteger, nullable=True)
+    
     # Relationship to sales
     sales = db.relationship('SaleTransaction', backref='customer', lazy=True)
     
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'phone': self.phone,
+            'email': self.email
+        }
+    
     def __repr__(self):
         return f"<Customer {self.name}>"
 
+# Prefix searches on name and exact email lookups, both case-insensitive
+db.Index('ix_customers_name_prefix', func.lower(Customer.name).label('name_lower'),
+         postgresql_ops={'name_lower': 'text_pattern_ops'})
+db.Index('ix_customers_email_lower', func.lower(Customer.email))
+# Last nine digits, so numbers with and without a country code meet
+db.Index('ix_customers_phone_suffix', func.right(Customer.phone_digits, 9))
+
 class SaleTransaction(db.Model):
     __tablename__ = 'sale_transactions'
+    __table_args__ = (
+        db.Index('ix_sale_transactions_sale_date', 'sale_date'),
+        db.Index('ix_sale_transactions_user_id_sale_date', 'user_id', 'sale_date'),
+        db.Index('ix_sale_transactions_customer_id_sale_date', 'customer_id', 'sale_date', 'id'),
+        db.Index('ix_sale_transactions_row_version', 'row_version'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     transaction_id = db.Column(db.String(100), unique=True, nullable=False)
@@ -83,6 +136,7 @@ class SaleTransaction(db.Model):
     payment_status = db.Column(db.String(20), default='completed')  # completed, pending, refunded
     sale_date = db.Column(db.DateTime, server_default=func.now())
     notes = db.Column(db.Text, nullable=True)
+    row_version = db.Column(db.BigInteger, nullable=True)
     
     # Relationships
     user = db.relationship('User', backref='sales')
@@ -93,6 +147,11 @@ class SaleTransaction(db.Model):
 
 class SaleItem(db.Model):
     __tablename__ = 'sale_items'
+    __table_args__ = (
+        db.Index('ix_sale_items_sale_id', 'sale_id'),
+        db.Index('ix_sale_items_medication_id', 'medication_id'),
+        db.Index('ix_sale_items_row_version', 'row_version'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     sale_id = db.Column(db.Integer, db.ForeignKey('sale_transactions.id'), nullable=False)
@@ -100,6 +159,27 @@ class SaleItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Numeric(10, 2), nullable=False)
     total_price = db.Column(db.Numeric(10, 2), nullable=False)
+    row_version = db.Column(db.BigInteger, nullable=True)
+    
+    def __repr__(self):
+        return f"<SaleItem {self.id}>"
+
+class RowTombstone(db.Model):
+    """A deleted row, or with no row_id a truncated table, recorded by trigger for incremental backups"""
+    __tablename__ = 'row_tombstones'
+    __table_args__ = (
+        db.Index('ix_row_tombstones_row_version', 'row_version'),
+    )
+    
+    # table_name of the marker a full backup leaves when it prunes tombstones:
+    # readers synced from before its row_version have missed deletes
+    PRUNED = '*'
+    
+    id = db.Column(db.BigInteger, primary_key=True)
+    table_name = db.Column(db.String(63), nullable=False)
+    row_id = db.Column(db.Integer, nullable=True)
+    row_version = db.Column(db.BigInteger, nullable=False)
+    deleted_at = db.Column(db.DateTime, server_default=func.now())
     
     def __repr__(self):
-        return f"<SaleItem {self.id}>"
\ No newline at end of file
+        return f"<RowTombstone {self.table_name} {self.row_id}>"
\ No newline at end of file
@@ -1,51 +1,87 @@
-# FIX: Added jsonify and or_ to imports
+# FIX: Added jsonify to imports
 from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
 from flask_login import login_required
-from sqlalchemy import func, or_, desc
+from sqlalchemy import func, desc
 from app import db
 from app.models import Customer, SaleTransaction # Assuming SaleTransaction model is available
+from app.utils.helpers import search_customers, get_customer_stats, get_customer_sales_page
+from app.utils.dedup import find_duplicate_groups, find_possible_duplicates, merge_customers, DEFAULT_MIN_SCORE
+from app.utils.decorators import admin_required
+from app.utils.fanout import fan_out
+from app.utils.analytics import compute_rfm_segments, get_rfm_segment_counts
 
 customers_bp = Blueprint('customers', __name__, url_prefix='/customers')
 
 @customers_bp.route('/')
 @login_required
 def customers():
+    # RFM segments are stored on the customer; admins recompute them here or via `flask refresh-stats`
+    segment = request.args.get('segment')
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 25, type=int), 100)
+    
     # --- Main Query for the Customer List ---
     # Gets each customer with their total sales count and amount spent in one go.
-    customers_query = db.session.query(
-        Customer,
-        func.count(SaleTransaction.id).label('sales_count'),
-        func.coalesce(func.sum(SaleTransaction.total_amount), 0).label('total_spent')
-    ).outerjoin(SaleTransaction).group_by(Customer.id)
-    
-    # --- Additional Queries for Statistics ---
-    # These are now fast because they are simple, direct queries.
-    total_revenue = db.session.query(func.sum(SaleTransaction.total_amount)).scalar() or 0
+    # Built per task, since each task queries through its own session.
+    def customer_totals():
+        return db.session.query(
+            Customer,
+            func.count(SaleTransaction.id).label('sales_count'),
+            func.coalesce(func.sum(SaleTransaction.total_amount), 0).label('total_spent')
+        ).outerjoin(SaleTransaction).group_by(Customer.id)
     
-    active_customer_count = db.session.query(
-        func.count(Customer.id.distinct())
-    ).join(SaleTransaction).scalar()
+    def listed_customers():
+        query = customer_totals()
+        if segment == 'none':
+            query = query.filter(Customer.rfm_segment.is_(None))
+        elif segment:
+            query = query.filter(Customer.rfm_segment == segment)
+        return query.order_by(Customer.name, Customer.id).paginate(page=page, per_page=per_page, error_out=False)
     
-    new_customer_count = db.session.query(func.count(Customer.id))\
-        .filter(Customer.sales == None).scalar()
-
-    # --- Queries for Customer Insights ---
-    top_spender = customers_query.order_by(desc('total_spent')).first()
-    most_frequent = customers_query.order_by(desc('sales_count')).first()
-    newest_customer = Customer.query.order_by(Customer.created_at.desc()).first()
+    # --- The sales aggregates run concurrently; the page waits for the slowest ---
+    results = fan_out(
+        customers=listed_customers,
+        sales_totals=lambda: db.session.query(
+            func.coalesce(func.sum(SaleTransaction.total_amount), 0).label('revenue'),
+            func.count(SaleTransaction.customer_id.distinct()).label('active_customers')
+        ).one(),
+        # --- Queries for Customer Insights ---
+        top_spender=lambda: customer_totals().order_by(desc('total_spent')).first(),
+        most_frequent=lambda: customer_totals().order_by(desc('sales_count')).first()
+    )
+    pagination = results['customers']
+    sales_totals = results['sales_totals']
+    top_spender = results['top_spender']
+    most_frequent = results['most_frequent']
+    customer_count = db.session.query(func.count(Customer.id)).scalar()
     
     # --- Pass all pre-calculated data to the template ---
     return render_template(
         'customers/customers.html', 
-        customers=customers_query.order_by(Customer.name).all(),
-        total_revenue=total_revenue,
-        active_customer_count=active_customer_count,
-        new_customer_count=new_customer_count,
+        customers=pagination.items,
+        pagination=pagination,
+        segment=segment,
+        segment_counts=get_rfm_segment_counts(),
+        total_revenue=sales_totals.revenue,
+        active_customer_count=sales_totals.active_customers,
+        # Customers without a purchase yet
+        new_customer_count=customer_count - sales_totals.active_customers,
         top_spender=top_spender[0] if top_spender else None,
         most_frequent_customer=most_frequent[0] if most_frequent else None,
-        newest_customer=newest_customer
+        newest_customer=Customer.query.order_by(Customer.created_at.desc()).first()
     )
 
+@customers_bp.route('/segments/refresh', methods=['POST'])
+@login_required
+@admin_required
+def refresh_customer_segments():
+    try:
+        counts = compute_rfm_segments()
+        flash(f'Segmented {sum(counts.values())} customers with purchases.', 'success')
+    except Exception as e:
+        flash(f'Error computing segments: {str(e)}', 'danger')
+    return redirect(url_for('customers.customers'))
+
 @customers_bp.route('/add', methods=['GET', 'POST'])
 @login_required
 def add_customer():
@@ -66,6 +102,10 @@ def add_customer():
             db.session.commit()
             
             flash('Customer added successfully!', 'success')
+            duplicates = find_possible_duplicates(customer)
+            if duplicates:
+                names = ', '.join(f'{duplicate.name} (#{duplicate.id})' for duplicate in duplicates)
+                flash(f'Possible duplicate of {names}. Review it under Find Duplicates.', 'warning')
             return redirect(url_for('customers.customers'))
             
         except Exception as e:
@@ -125,28 +165,65 @@ def delete_customer(id):
 @login_required
 def view_customer(id):
     customer = Customer.query.get_or_404(id)
-    return render_template('customers/view_customer.html', customer=customer)
+    per_page = min(request.args.get('per_page', 25, type=int), 100)
+    history = get_customer_sales_page(
+        customer.id,
+        before=request.args.get('before'),
+        after=request.args.get('after'),
+        per_page=per_page
+    )
+    return render_template('customers/view_customer.html',
+                           customer=customer,
+                           stats=get_customer_stats(customer.id),
+                           history=history,
+                           per_page=per_page)
+
+@customers_bp.route('/duplicates')
+@login_required
+def duplicate_customers():
+    min_score = request.args.get('min_score', DEFAULT_MIN_SCORE, type=float)
+    groups = find_duplicate_groups(min_score=min_score, limit=100)
+    
+    # Members of the listed groups with their purchase counts, in one query
+    customer_ids = [customer_id for group in groups for customer_id in group['customer_ids']]
+    rows = db.session.query(
+        Customer,
+        func.count(SaleTransaction.id).label('sales_count'),
+        func.max(SaleTransaction.sale_date).label('last_purchase')
+    ).outerjoin(SaleTransaction).filter(Customer.id.in_(customer_ids)).group_by(Customer.id).all()
+    members = {customer.id: (customer, sales_count, last_purchase) for customer, sales_count, last_purchase in rows}
+    
+    for group in groups:
+        group['members'] = [members[customer_id] for customer_id in group['customer_ids'] if customer_id in members]
+    
+    return render_template('customers/duplicates.html', groups=groups, min_score=min_score)
+
+@customers_bp.route('/merge', methods=['POST'])
+@login_required
+@admin_required
+def merge_customer_records():
+    target_id = request.form.get('target_id', type=int)
+    duplicate_ids = [int(customer_id) for customer_id in request.form.getlist('customer_ids') if customer_id.isdigit()]
+    
+    try:
+        moved = merge_customers(target_id, duplicate_ids)
+        flash(f'Merged {len(set(duplicate_ids) - {target_id})} customer(s); {moved} sale(s) moved.', 'success')
+    except ValueError as e:
+        flash(str(e), 'danger')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error merging customers: {str(e)}', 'danger')
+    
+    return redirect(url_for('customers.duplicate_customers'))
 
 # --- API ---
 @customers_bp.route('/api/search')
 @login_required
 def api_customers_search():
     search_term = request.args.get('q', '')
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    
+    # Ranked and limited; an empty term returns nothing rather than every customer
+    customers = search_customers(search_term, limit=limit)
     
-    # IMPROVEMENT: Use a helper or inline query for clarity
-    query = Customer.query
-    if search_term:
-        search_pattern = f'%{search_term}%'
-        query = query.filter(
-            or_(
-                Customer.name.ilike(search_pattern),
-                Customer.phone.ilike(search_pattern),
-                Customer.email.ilike(search_pattern)
-            )
-        )
-    customers = query.order_by(Customer.name).all()
-    
-    # IMPROVEMENT: Use a to_dict() method on the model for cleaner serialization
-    results = [customer.to_dict() for customer in customers]
-    
-    return jsonify(results) # FIX: Return a proper JSON response
\ No newline at end of file
+    return jsonify([customer.to_dict() for customer in customers])
@@ -1,10 +1,11 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, send_file
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, send_file, Response, stream_with_context
 from flask_login import login_required, current_user
 from app import db
 from app.models import Medication
 from app.utils.decorators import admin_required
-from app.utils.helpers import get_low_stock_medications, get_expired_medications, get_expiring_soon_medications
+from app.utils.helpers import get_low_stock_medications, get_expired_medications, get_expiring_soon_medications, get_all_medications, get_all_medications_query
 from datetime import datetime
+import json
 import pandas as pd
 from io import BytesIO
 
@@ -15,6 +16,7 @@ inventory_bp = Blueprint('inventory', __name__)
 def inventory():
     filter_type = request.args.get('filter', 'all')
     today = datetime.now().date()
+    pagination = None
     
     if filter_type == 'low_stock':
         medications = get_low_stock_medications()
@@ -23,9 +25,14 @@ def inventory():
     elif filter_type == 'expiring_soon':
         medications = get_expiring_soon_medications()
     else:
-        medications = Medication.query.filter_by(deleted=False).order_by(Medication.name).all()
+        # The full catalogue is paged rather than rendered in one go
+        page = request.args.get('page', 1, type=int)
+        per_page = min(request.args.get('per_page', 100, type=int), 500)
+        pagination = get_all_medications_query().paginate(page=page, per_page=per_page, error_out=False)
+        medications = pagination.items
     
-    return render_template('inventory/inventory.html', medications=medications, filter_type=filter_type, now=today)
+    return render_template('inventory/inventory.html', medications=medications, pagination=pagination,
+                           filter_type=filter_type, now=today)
 
 @inventory_bp.route('/add', methods=['GET', 'POST'])
 @login_required
@@ -287,29 +294,16 @@ def api_medications():
     search_term = request.args.get('q', '')
     if search_term:
         from app.utils.helpers import search_medications
-        medications = search_medications(search_term)
-    else:
-        medications = Medication.query.filter_by(deleted=False).order_by(Medication.name).all()
+        return jsonify([medication_to_dict(med) for med in search_medications(search_term)])
     
-    # Convert to list of dictionaries
-    medications_list = []
-    for med in medications:
-        med_dict = {
-            'id': med.id,
-            'name': med.name,
-            'generic_name': med.generic_name,
-            'manufacturer': med.manufacturer,
-            'price': float(med.price),
-            'cost_price': float(med.cost_price) if med.cost_price else None,
-            'stock_quantity': med.stock_quantity,
-            'expiry_date': med.expiry_date.isoformat() if med.expiry_date else None,
-            'category': med.category,
-            'barcode': med.barcode,
-            'created_at': med.created_at.isoformat() if med.created_at else None
-        }
-        medications_list.append(med_dict)
+    # The whole catalogue is written out as it is read from the cursor
+    def generate():
+        yield '['
+        for count, med in enumerate(get_all_medications()):
+            yield (',' if count else '') + json.dumps(medication_to_dict(med))
+        yield ']'
     
-    return jsonify(medications_list)
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 @inventory_bp.route('/api/medications/search')
 @login_required
@@ -350,4 +344,20 @@ def expired():
 @login_required
 def expiring_soon():
     medications = get_expiring_soon_medications()
-    return render_template('inventory/expiring_soon.html', medications=medications)
\ No newline at end of file
+    return render_template('inventory/expiring_soon.html', medications=medications)
+
+# Helper functions
+def medication_to_dict(med):
+    return {
+        'id': med.id,
+        'name': med.name,
+        'generic_name': med.generic_name,
+        'manufacturer': med.manufacturer,
+        'price': float(med.price),
+        'cost_price': float(med.cost_price) if med.cost_price else None,
+        'stock_quantity': med.stock_quantity,
+        'expiry_date': med.expiry_date.isoformat() if med.expiry_date else None,
+        'category': med.category,
+        'barcode': med.barcode,
+        'created_at': med.created_at.isoformat() if med.created_at else None
+    }
@@ -1,11 +1,11 @@
 # FIX: Moved all imports to the top of the file for clarity and best practice.
-from flask import Blueprint, render_template, redirect, url_for, request
+from flask import Blueprint, render_template, redirect, url_for, request, Response
 from flask_login import current_user, login_required
 from sqlalchemy import or_
-from datetime import datetime, timedelta
 
-from app.models import SaleTransaction, Medication, User
-from app.utils.helpers import get_sales_summary, get_daily_sales_chart_data, get_expiring_soon_medications
+from app.models import Medication
+from app.utils.helpers import get_cached_sales_summary, get_cached_daily_sales_chart_data
+from app.utils.live_stats import live_stats
 
 main_bp = Blueprint('main', __name__)
 
@@ -17,35 +17,28 @@ def index():
     # The @login_required decorator already handles this.
 
     # User is logged in - show dashboard
-    stats = get_sales_summary()
-    
-    # Get additional stats for dashboard
-    expiring_soon_count = len(get_expiring_soon_medications())
-    
-    # Get recent activity counts
-    one_day_ago = datetime.now() - timedelta(days=1)
-    recent_sales_count = SaleTransaction.query.filter(
-        SaleTransaction.sale_date >= one_day_ago
-    ).count()
-    
-    seven_days_ago = datetime.now() - timedelta(days=7)
-    recent_medications_count = Medication.query.filter(
-        Medication.created_at >= seven_days_ago
-    ).count()
-    
-    total_users_count = User.query.count()
-    
-    # Get chart data
-    chart_data = get_daily_sales_chart_data(7)
+    # Every counter comes from one cached summary statement
+    stats = get_cached_sales_summary()
+    chart_data = get_cached_daily_sales_chart_data(7)
     
     return render_template('index.html', 
                            stats=stats,
-                           expiring_soon_count=expiring_soon_count,
-                           recent_sales_count=recent_sales_count,
-                           recent_medications_count=recent_medications_count,
-                           total_users_count=total_users_count,
+                           expiring_soon_count=stats['expiring_soon_count'],
+                           recent_sales_count=stats['recent_sales_count'],
+                           recent_medications_count=stats['recent_medications_count'],
+                           total_users_count=stats['total_users_count'],
                            chart_data=chart_data)
 
+@main_bp.route('/api/dashboard/stream')
+@login_required
+def dashboard_stream():
+    """Server-sent events carrying dashboard figures whenever sales or stock change"""
+    snapshot = get_cached_sales_summary()
+    return Response(live_stats.stream(snapshot), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @main_bp.route('/search')
 @login_required  # FIX: Added decorator to make this a secure, members-only page.
 def search():
@@ -1,11 +1,16 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, send_file, jsonify
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
 from flask_login import login_required, current_user
 from app import db
-from app.models import SaleTransaction, SaleItem, Medication, Customer
-from app.utils.helpers import get_sales_report, get_daily_sales_chart_data, get_sales_summary
-from datetime import datetime, timedelta
-import pandas as pd
-from io import BytesIO
+from app.models import SaleTransaction, SaleItem, Medication, Customer, User
+from app.utils.helpers import get_daily_sales_chart_data, get_cached_sales_summary, get_sales_report_query
+from app.utils.exports import stream_rows, export_response
+from app.utils.analytics_store import analytics_store
+from app.utils.decorators import admin_required
+from app.utils.analytics import get_abc_analysis, get_demand_forecast, get_sales_heatmap, get_comparison_periods, get_period_comparison, get_cashier_performance, get_sales_timeseries, MAX_TIMESERIES_DAYS, DEFAULT_MAX_POINTS, refresh_medication_sales_stats, get_dead_stock_query, get_dead_stock_summary, get_expiry_risk
+from sqlalchemy import func
+from datetime import datetime, date, timedelta
+
+DEAD_STOCK_DAYS = (30, 60, 90, 180)
 
 reports_bp = Blueprint('reports', __name__, url_prefix='/reports')
 
@@ -53,26 +58,33 @@ def reports():
 def sales_reports():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 25, type=int), 100)
     
     if start_date and end_date:
         try:
             start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-            sales = get_sales_report(start_date, end_date)
         except ValueError:
             flash('Invalid date format', 'danger')
-            sales = []
+            start_date = end_date = None
     else:
-        # Default to current month
-        current_month = datetime.now().strftime('%Y-%m')
-        sales = get_sales_report()
+        start_date = end_date = None
     
-    # Calculate totals
-    total_sales = sum(sale.total_amount for sale in sales)
-    total_transactions = len(sales)
+    # Breakdown and totals come from one GROUP BY; only the current page is loaded
+    payment_stats = get_payment_method_stats(start_date, end_date)
+    total_sales = sum(stats['amount'] for stats in payment_stats.values())
+    total_transactions = sum(stats['count'] for stats in payment_stats.values())
+    
+    pagination = get_sales_report_query(start_date, end_date).paginate(
+        page=page, per_page=per_page, error_out=False, count=False
+    )
+    pagination.total = total_transactions
     
     return render_template('reports/sales_reports.html', 
-                         sales=sales, 
+                         sales=pagination.items,
+                         pagination=pagination,
+                         payment_stats=payment_stats,
                          total_sales=total_sales, 
                          total_transactions=total_transactions,
                          start_date=start_date,
@@ -83,60 +95,72 @@ def sales_reports():
 def export_sales_report():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
+    export_format = request.args.get('format', 'xlsx')
     
     if start_date and end_date:
         try:
             start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-            sales = get_sales_report(start_date, end_date)
         except ValueError:
             flash('Invalid date format', 'danger')
             return redirect(url_for('reports.sales_reports'))
     else:
-        sales = get_sales_report()
-    
-    # Create DataFrame
-    data = []
-    for sale in sales:
-        data.append({
-            'Transaction ID': sale.transaction_id,
-            'Date': sale.sale_date.strftime('%Y-%m-%d %H:%M'),
-            'Customer': sale.customer.name if sale.customer else 'Walk-in',
-            'Total Amount': float(sale.total_amount),
-            'Tax': float(sale.tax_amount),
-            'Discount': float(sale.discount_amount),
-            'Payment Method': sale.payment_method,
-            'Cashier': sale.user.username
-        })
-    
-    df = pd.DataFrame(data)
-    
-    # Create Excel file in memory
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Sales Report', index=False)
-    
-    output.seek(0)
-    
-    filename = f'sales_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-    return send_file(output, as_attachment=True, download_name=filename)
+        start_date = end_date = None
+    
+    query = db.session.query(
+        SaleTransaction.transaction_id,
+        SaleTransaction.sale_date,
+        Customer.name,
+        SaleTransaction.total_amount,
+        SaleTransaction.tax_amount,
+        SaleTransaction.discount_amount,
+        SaleTransaction.payment_method,
+        User.username
+    ).outerjoin(Customer, SaleTransaction.customer_id == Customer.id
+    ).join(User, SaleTransaction.user_id == User.id
+    ).filter(SaleTransaction.payment_status == 'completed')
+    query = filter_sale_date(query, start_date, end_date)
+    query = query.order_by(SaleTransaction.sale_date.desc())
+    
+    # Rows go straight from the cursor into the export, one chunk at a time
+    rows = (
+        (
+            row.transaction_id,
+            row.sale_date.strftime('%Y-%m-%d %H:%M') if row.sale_date else '',
+            row.name or 'Walk-in',
+            float(row.total_amount),
+            float(row.tax_amount or 0),
+            float(row.discount_amount or 0),
+            row.payment_method,
+            row.username
+        )
+        for row in stream_rows(query)
+    )
+    
+    headers = ['Transaction ID', 'Date', 'Customer', 'Total Amount', 'Tax', 'Discount', 'Payment Method', 'Cashier']
+    return export_response('sales_report', 'Sales Report', headers, rows, export_format)
 
 @reports_bp.route('/inventory')
 @login_required
 def inventory_reports():
     filter_type = request.args.get('filter', 'all')
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 50, type=int), 200)
+    conditions = get_inventory_conditions(filter_type)
     
-    if filter_type == 'low_stock':
-        medications = get_low_stock_medications()
-    elif filter_type == 'expired':
-        medications = get_expired_medications()
-    elif filter_type == 'expiring_soon':
-        medications = get_expiring_soon_medications()
-    else:
-        medications = get_all_medications()
+    summary = get_inventory_summary(conditions)
+    categories = get_inventory_categories(conditions)
+    
+    pagination = Medication.query.filter(*conditions).order_by(Medication.name).paginate(
+        page=page, per_page=per_page, error_out=False, count=False
+    )
+    pagination.total = summary['count']
     
     return render_template('reports/inventory_reports.html', 
-                         medications=medications, 
+                         medications=pagination.items,
+                         pagination=pagination,
+                         summary=summary,
+                         categories=categories,
                          filter_type=filter_type,
                          now=datetime.now().date())
 
@@ -144,42 +168,38 @@ def inventory_reports():
 @login_required
 def export_inventory_report():
     filter_type = request.args.get('filter', 'all')
+    export_format = request.args.get('format', 'xlsx')
+    
+    query = db.session.query(
+        Medication.name,
+        Medication.generic_name,
+        Medication.manufacturer,
+        Medication.price,
+        Medication.cost_price,
+        Medication.stock_quantity,
+        Medication.expiry_date,
+        Medication.category,
+        Medication.barcode
+    ).filter(*get_inventory_conditions(filter_type))
+    query = query.order_by(Medication.name)
+    
+    rows = (
+        (
+            row.name,
+            row.generic_name,
+            row.manufacturer,
+            float(row.price),
+            float(row.cost_price) if row.cost_price else 0,
+            row.stock_quantity,
+            row.expiry_date.strftime('%Y-%m-%d') if row.expiry_date else 'N/A',
+            row.category,
+            row.barcode
+        )
+        for row in stream_rows(query)
+    )
     
-    if filter_type == 'low_stock':
-        medications = get_low_stock_medications()
-    elif filter_type == 'expired':
-        medications = get_expired_medications()
-    elif filter_type == 'expiring_soon':
-        medications = get_expiring_soon_medications()
-    else:
-        medications = get_all_medications()
-    
-    # Create DataFrame
-    data = []
-    for med in medications:
-        data.append({
-            'Name': med.name,
-            'Generic Name': med.generic_name,
-            'Manufacturer': med.manufacturer,
-            'Price': float(med.price),
-            'Cost Price': float(med.cost_price) if med.cost_price else 0,
-            'Stock Quantity': med.stock_quantity,
-            'Expiry Date': med.expiry_date.strftime('%Y-%m-%d') if med.expiry_date else 'N/A',
-            'Category': med.category,
-            'Barcode': med.barcode
-        })
-    
-    df = pd.DataFrame(data)
-    
-    # Create Excel file in memory
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Inventory Report', index=False)
-    
-    output.seek(0)
-    
-    filename = f'inventory_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-    return send_file(output, as_attachment=True, download_name=filename)
+    headers = ['Name', 'Generic Name', 'Manufacturer', 'Price', 'Cost Price', 'Stock Quantity', 'Expiry Date', 'Category', 'Barcode']
+    return export_response('inventory_report', 'Inventory Report', headers, rows, export_format)
 
 @reports_bp.route('/profit')
 @login_required
@@ -194,7 +214,8 @@ def profit_reports():
             profit_data = get_profit_report(start_date, end_date)
         except ValueError:
             flash('Invalid date format', 'danger')
-            profit_data = {'sales': [], 'total_profit': 0, 'total_revenue': 0}
+            profit_data = {'sales': [], 'total_profit': 0, 'total_revenue': 0,
+                           'max_profit': 0, 'min_profit': 0, 'profitable_count': 0}
     else:
         # Default to current month
         current_month = datetime.now().strftime('%Y-%m')
@@ -204,6 +225,10 @@ def profit_reports():
                          sales=profit_data['sales'], 
                          total_profit=profit_data['total_profit'],
                          total_revenue=profit_data['total_revenue'],
+                         max_profit=profit_data['max_profit'],
+                         min_profit=profit_data['min_profit'],
+                         profitable_count=profit_data['profitable_count'],
+                         data_source=analytics_store.get_status(),
                          start_date=start_date,
                          end_date=end_date)
 
@@ -212,180 +237,479 @@ def profit_reports():
 def export_profit_report():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
+    export_format = request.args.get('format', 'xlsx')
     
     if start_date and end_date:
         try:
             start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-            profit_data = get_profit_report(start_date, end_date)
         except ValueError:
             flash('Invalid date format', 'danger')
             return redirect(url_for('reports.profit_reports'))
     else:
-        profit_data = get_profit_report()
+        start_date = end_date = None
+    
+    query = get_profit_query(start_date, end_date)
+    
+    rows = (
+        (
+            row.transaction_id,
+            row.sale_date.strftime('%Y-%m-%d %H:%M') if row.sale_date else '',
+            row.name or 'Walk-in',
+            float(row.total_amount),
+            float(row.profit),
+            row.payment_method,
+            row.username
+        )
+        for row in stream_rows(query)
+    )
     
-    # Create DataFrame
-    data = []
-    for sale in profit_data['sales']:
-        data.append({
-            'Transaction ID': sale.transaction_id,
-            'Date': sale.sale_date.strftime('%Y-%m-%d %H:%M'),
-            'Customer': sale.customer.name if sale.customer else 'Walk-in',
-            'Total Revenue': float(sale.total_amount),
-            'Total Profit': float(get_sale_profit(sale.id)),
-            'Payment Method': sale.payment_method,
-            'Cashier': sale.user.username
-        })
+    headers = ['Transaction ID', 'Date', 'Customer', 'Total Revenue', 'Total Profit', 'Payment Method', 'Cashier']
+    return export_response('profit_report', 'Profit Report', headers, rows, export_format)
+
+@reports_bp.route('/abc')
+@login_required
+def abc_reports():
+    start_date, end_date = get_report_date_range(default_days=90)
+    category = request.args.get('category') or None
+    
+    abc_data = get_abc_analysis(start_date, end_date, category=category)
+    categories = [
+        row[0] for row in db.session.query(Medication.category).filter(
+            Medication.category.isnot(None),
+            Medication.category != ''
+        ).distinct().order_by(Medication.category)
+    ]
+    
+    return render_template('reports/abc_reports.html',
+                         abc_data=abc_data,
+                         data_source=analytics_store.get_status(),
+                         categories=categories,
+                         category=category,
+                         start_date=start_date,
+                         end_date=end_date)
+
+@reports_bp.route('/api/abc')
+@login_required
+def api_abc_analysis():
+    start_date, end_date = get_report_date_range(default_days=90)
+    abc_data = get_abc_analysis(start_date, end_date, category=request.args.get('category') or None)
+    return jsonify({'status': 'success', 'data': abc_data})
+
+@reports_bp.route('/forecast')
+@login_required
+def forecast_reports():
+    options = get_forecast_options()
+    show = request.args.get('show', 'reorder')
+    
+    forecast = get_demand_forecast(**options)
+    reorder_items = [item for item in forecast if item['needs_reorder']]
+    medications = forecast if show == 'all' else reorder_items
+    
+    return render_template('reports/forecast_reports.html',
+                         medications=medications,
+                         reorder_count=len(reorder_items),
+                         total_count=len(forecast),
+                         order_cost=sum(item['order_cost'] for item in reorder_items),
+                         show=show,
+                         **options)
+
+@reports_bp.route('/export/forecast')
+@login_required
+def export_forecast_report():
+    export_format = request.args.get('format', 'xlsx')
+    forecast = get_demand_forecast(**get_forecast_options())
+    
+    rows = (
+        (
+            item['name'],
+            item['category'],
+            item['stock_quantity'],
+            item['units_sold'],
+            round(item['daily_forecast'], 2),
+            round(item['days_of_cover'], 1) if item['days_of_cover'] is not None else 'N/A',
+            item['stockout_date'].strftime('%Y-%m-%d') if item['stockout_date'] else 'N/A',
+            round(item['reorder_point'], 1),
+            item['suggested_quantity'],
+            round(item['order_cost'], 2)
+        )
+        for item in forecast
+    )
     
-    df = pd.DataFrame(data)
+    headers = ['Name', 'Category', 'Stock Quantity', 'Units Sold', 'Daily Forecast', 'Days of Cover',
+               'Stockout Date', 'Reorder Point', 'Suggested Order', 'Order Cost']
+    return export_response('reorder_report', 'Reorder Suggestions', headers, rows, export_format)
+
+@reports_bp.route('/comparison')
+@login_required
+def comparison_reports():
+    compare, current, previous = get_comparison_options()
+    comparison = get_period_comparison(current, previous)
+    
+    return render_template('reports/comparison_reports.html',
+                         comparison=comparison,
+                         compare=compare,
+                         start_date=current[0],
+                         end_date=current[1])
+
+@reports_bp.route('/api/comparison')
+@login_required
+def api_comparison():
+    compare, current, previous = get_comparison_options()
+    comparison = get_period_comparison(current, previous)
+    comparison['compare'] = compare
+    return jsonify({'status': 'success', 'data': comparison})
+
+@reports_bp.route('/cashiers')
+@login_required
+def cashier_reports():
+    start_date, end_date = get_report_date_range(default_days=30)
+    user_id = request.args.get('user_id', type=int)
     
-    # Create Excel file in memory
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Profit Report', index=False)
+    cashiers = get_cashier_performance(start_date, end_date, user_id=user_id)
+    users = User.query.order_by(User.username).all()
     
-    output.seek(0)
+    return render_template('reports/cashier_reports.html',
+                         cashiers=cashiers,
+                         users=users,
+                         user_id=user_id,
+                         start_date=start_date,
+                         end_date=end_date)
+
+@reports_bp.route('/export/cashiers')
+@login_required
+def export_cashier_report():
+    export_format = request.args.get('format', 'xlsx')
+    start_date, end_date = get_report_date_range(default_days=30)
+    cashiers = get_cashier_performance(start_date, end_date, user_id=request.args.get('user_id', type=int))
+    
+    rows = (
+        (
+            cashier['username'],
+            stats.get('shift', 'All Shifts'),
+            stats['transactions'],
+            round(stats['transactions_per_hour'], 2),
+            round(stats['revenue'], 2),
+            round(stats['average_basket'], 2),
+            round(stats['items_per_transaction'], 2),
+            round(stats['discounts'], 2),
+            stats['refunded'],
+            round(stats['refund_rate'], 1)
+        )
+        for cashier in cashiers
+        for stats in [cashier['totals'], *cashier['shifts']]
+    )
     
-    filename = f'profit_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-    return send_file(output, as_attachment=True, download_name=filename)
+    headers = ['Cashier', 'Shift', 'Transactions', 'Transactions per Hour', 'Revenue', 'Average Basket',
+               'Items per Transaction', 'Discounts', 'Refunds', 'Refund Rate (%)']
+    return export_response('cashier_report', 'Cashier Report', headers, rows, export_format)
+
+@reports_bp.route('/dead_stock')
+@login_required
+def dead_stock_reports():
+    days = request.args.get('days', 90, type=int)
+    if days not in DEAD_STOCK_DAYS:
+        days = 90
+    mode = request.args.get('mode', 'dead')
+    if mode not in ('dead', 'slow'):
+        mode = 'dead'
+    page = request.args.get('page', 1, type=int)
+    
+    summary = get_dead_stock_summary(days, mode)
+    stock_value = Medication.stock_quantity * func.coalesce(Medication.cost_price, Medication.price)
+    pagination = get_dead_stock_query(days, mode).order_by(
+        stock_value.desc(), Medication.name
+    ).paginate(page=page, per_page=50, error_out=False, count=False)
+    pagination.total = summary['count']
+    
+    today = datetime.now().date()
+    risks = {med.id: get_expiry_risk(med, today) for med in pagination.items}
+    
+    return render_template('reports/dead_stock_reports.html',
+                         medications=pagination.items,
+                         pagination=pagination,
+                         summary=summary,
+                         risks=risks,
+                         days=days,
+                         mode=mode,
+                         day_options=DEAD_STOCK_DAYS,
+                         now=datetime.now())
+
+@reports_bp.route('/dead_stock/rebuild', methods=['POST'])
+@login_required
+@admin_required
+def rebuild_dead_stock_stats():
+    """Rebuild last sold dates and rolling units from the full sales history"""
+    try:
+        refresh_medication_sales_stats(full=True)
+        flash('Sales velocity rebuilt from the full sales history.', 'success')
+    except Exception as e:
+        flash(f'Error rebuilding sales velocity: {str(e)}', 'danger')
+    return redirect(url_for('reports.dead_stock_reports', days=request.args.get('days'), mode=request.args.get('mode')))
 
 @reports_bp.route('/api/sales/chart')
 @login_required
 def api_sales_chart():
-    days = int(request.args.get('days', 30))
+    days = min(max(request.args.get('days', 30, type=int), 1), MAX_TIMESERIES_DAYS)
     chart_data = get_daily_sales_chart_data(days)
     return jsonify({'status': 'success', 'data': chart_data})
 
+@reports_bp.route('/api/sales/timeseries')
+@login_required
+def api_sales_timeseries():
+    start_date, end_date = get_report_date_range(default_days=30)
+    if start_date > end_date:
+        return jsonify({'status': 'error', 'message': 'start_date must not be after end_date'}), 400
+    # Long ranges are cut to the most recent MAX_TIMESERIES_DAYS days
+    start_date = max(start_date, end_date - timedelta(days=MAX_TIMESERIES_DAYS - 1))
+    
+    bucket = request.args.get('bucket', 'auto')
+    if bucket not in ('auto', 'hour', 'day', 'week', 'month'):
+        return jsonify({'status': 'error', 'message': 'bucket must be one of auto, hour, day, week, month'}), 400
+    max_points = min(max(request.args.get('max_points', DEFAULT_MAX_POINTS, type=int), 10), 1000)
+    
+    series = get_sales_timeseries(start_date, end_date, bucket=bucket, max_points=max_points)
+    return jsonify({'status': 'success', 'data': series})
+
+@reports_bp.route('/api/sales/heatmap')
+@login_required
+def api_sales_heatmap():
+    start_date, end_date = get_report_date_range(default_days=28)
+    heatmap = get_sales_heatmap(start_date, end_date)
+    heatmap['start_date'] = start_date.strftime('%Y-%m-%d')
+    heatmap['end_date'] = end_date.strftime('%Y-%m-%d')
+    return jsonify({'status': 'success', 'data': heatmap})
+
 @reports_bp.route('/api/sales_summary')
 @login_required
 def api_sales_summary():
-    stats = get_sales_summary()
+    stats = get_cached_sales_summary()
     return jsonify({'status': 'success', 'data': stats})
 
 @reports_bp.route('/customer')
 @login_required
 def customer_reports():
-    customers = Customer.query.order_by(Customer.name).all()
-    
-    # Calculate sales data for each customer
-    customer_data = []
-    for customer in customers:
-        sales_count = len(customer.sales)
-        total_spent = sum(sale.total_amount for sale in customer.sales)
-        customer_data.append({
-            'customer': customer,
-            'sales_count': sales_count,
-            'total_spent': total_spent
-        })
-    
-    # Sort by total spent descending
-    customer_data.sort(key=lambda x: x['total_spent'], reverse=True)
-    
-    return render_template('reports/customer_reports.html', customer_data=customer_data)
+    query = db.session.query(
+        Customer.id,
+        Customer.name,
+        Customer.phone,
+        Customer.email,
+        Customer.created_at,
+        func.count(SaleTransaction.id).label('sales_count'),
+        func.coalesce(func.sum(SaleTransaction.total_amount), 0).label('total_spent'),
+        func.max(SaleTransaction.sale_date).label('last_purchase')
+    ).outerjoin(SaleTransaction, SaleTransaction.customer_id == Customer.id
+    ).group_by(Customer.id, Customer.name, Customer.phone, Customer.email, Customer.created_at
+    ).order_by(func.coalesce(func.sum(SaleTransaction.total_amount), 0).desc())
+    
+    customer_data = [
+        {
+            'customer': row,
+            'sales_count': row.sales_count,
+            'total_spent': float(row.total_spent),
+            'last_purchase': row.last_purchase
+        }
+        for row in analytics_store.execute(query)
+    ]
+    
+    return render_template('reports/customer_reports.html',
+                         customer_data=customer_data,
+                         data_source=analytics_store.get_status())
 
 @reports_bp.route('/export/customer')
 @login_required
 def export_customer_report():
-    customers = Customer.query.order_by(Customer.name).all()
-    
-    # Create DataFrame
-    data = []
-    for customer in customers:
-        sales_count = len(customer.sales)
-        total_spent = sum(sale.total_amount for sale in customer.sales)
-        data.append({
-            'Customer Name': customer.name,
-            'Phone': customer.phone or 'N/A',
-            'Email': customer.email or 'N/A',
-            'Total Purchases': sales_count,
-            'Total Spent': float(total_spent),
-            'Average Purchase': float(total_spent / sales_count) if sales_count > 0 else 0
-        })
-    
-    df = pd.DataFrame(data)
-    
-    # Create Excel file in memory
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Customer Report', index=False)
-    
-    output.seek(0)
-    
-    filename = f'customer_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-    return send_file(output, as_attachment=True, download_name=filename)
+    export_format = request.args.get('format', 'xlsx')
+    
+    query = db.session.query(
+        Customer.name,
+        Customer.phone,
+        Customer.email,
+        func.count(SaleTransaction.id).label('sales_count'),
+        func.coalesce(func.sum(SaleTransaction.total_amount), 0).label('total_spent')
+    ).outerjoin(SaleTransaction, SaleTransaction.customer_id == Customer.id
+    ).group_by(Customer.id
+    ).order_by(Customer.name)
+    
+    rows = (
+        (
+            row.name,
+            row.phone or 'N/A',
+            row.email or 'N/A',
+            row.sales_count,
+            float(row.total_spent),
+            float(row.total_spent / row.sales_count) if row.sales_count > 0 else 0
+        )
+        for row in stream_rows(query)
+    )
+    
+    headers = ['Customer Name', 'Phone', 'Email', 'Total Purchases', 'Total Spent', 'Average Purchase']
+    return export_response('customer_report', 'Customer Report', headers, rows, export_format)
 
 # Helper functions
-def get_low_stock_medications(threshold=10):
-    from sqlalchemy import and_
-    return Medication.query.filter(
-        and_(
-            Medication.stock_quantity <= threshold,
-            Medication.deleted == False
-        )
-    ).all()
+def get_report_date_range(default_days=30):
+    """Read start_date/end_date from the query string, defaulting to the last default_days days"""
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=default_days)
+    
+    try:
+        if request.args.get('start_date'):
+            start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date()
+        if request.args.get('end_date'):
+            end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date()
+    except ValueError:
+        flash('Invalid date format', 'danger')
+    
+    return start_date, end_date
 
-def get_expired_medications():
-    from sqlalchemy import and_
-    today = datetime.now().date()
-    return Medication.query.filter(
-        and_(
-            Medication.expiry_date.isnot(None),
-            Medication.expiry_date < today,
-            Medication.deleted == False
-        )
-    ).all()
+def get_forecast_options():
+    """Read forecasting parameters from the query string"""
+    method = request.args.get('method', 'exponential')
+    if method not in ('exponential', 'moving_average'):
+        method = 'exponential'
+    
+    try:
+        history_days = min(max(int(request.args.get('history_days', 56)), 7), 365)
+        lead_time_days = min(max(int(request.args.get('lead_time_days', 7)), 0), 90)
+    except ValueError:
+        history_days, lead_time_days = 56, 7
+    
+    return {
+        'method': method,
+        'history_days': history_days,
+        'lead_time_days': lead_time_days
+    }
 
-def get_expiring_soon_medications(days=30):
-    from sqlalchemy import and_
-    today = datetime.now().date()
-    soon_date = today + timedelta(days=days)
-    return Medication.query.filter(
-        and_(
-            Medication.expiry_date.isnot(None),
-            Medication.expiry_date >= today,
-            Medication.expiry_date <= soon_date,
-            Medication.deleted == False
-        )
-    ).all()
+def get_comparison_options():
+    """Read the comparison preset (or custom range) from the query string"""
+    compare = request.args.get('compare', 'week')
+    if compare not in ('week', 'month', 'month_last_year', 'custom'):
+        compare = 'week'
+    
+    start_date = end_date = None
+    if compare == 'custom':
+        start_date, end_date = get_report_date_range(default_days=30)
+        if start_date > end_date:
+            flash('Start date must be before end date', 'danger')
+            start_date, end_date = end_date, start_date
+    
+    current, previous = get_comparison_periods(compare, start_date, end_date)
+    return compare, current, previous
 
-def get_all_medications():
-    return Medication.query.filter_by(deleted=False).order_by(Medication.name).all()
+def filter_sale_date(query, start_date=None, end_date=None):
+    """Sales on or after start_date and up to the end of end_date (both dates, inclusive)"""
+    if start_date:
+        query = query.filter(SaleTransaction.sale_date >= start_date)
+    if end_date:
+        query = query.filter(SaleTransaction.sale_date < end_date + timedelta(days=1))
+    return query
 
-def get_profit_report(start_date=None, end_date=None):
-    from sqlalchemy.orm import joinedload
-    query = SaleTransaction.query.options(
-        joinedload(SaleTransaction.customer),
-        joinedload(SaleTransaction.user)
+def get_payment_method_stats(start_date=None, end_date=None):
+    """Completed sales count and amount per payment method"""
+    query = db.session.query(
+        SaleTransaction.payment_method,
+        func.count(SaleTransaction.id).label('count'),
+        func.coalesce(func.sum(SaleTransaction.total_amount), 0).label('amount')
     ).filter(SaleTransaction.payment_status == 'completed')
+    query = filter_sale_date(query, start_date, end_date)
+    rows = query.group_by(SaleTransaction.payment_method).order_by(func.sum(SaleTransaction.total_amount).desc())
+    return {
+        row.payment_method: {'count': row.count, 'amount': float(row.amount)}
+        for row in rows
+    }
+
+def get_inventory_conditions(filter_type, low_stock_threshold=10, expiring_days=30):
+    """Filter conditions for the inventory report and its export"""
+    today = datetime.now().date()
+    conditions = [Medication.deleted == False]
     
-    if start_date and end_date:
-        query = query.filter(SaleTransaction.sale_date.between(start_date, end_date))
-    elif start_date:
-        query = query.filter(SaleTransaction.sale_date >= start_date)
-    elif end_date:
-        query = query.filter(SaleTransaction.sale_date <= end_date)
-    
-    sales = query.order_by(SaleTransaction.sale_date.desc()).all()
-    
-    total_profit = 0
-    total_revenue = 0
-    
-    for sale in sales:
-        sale_profit = get_sale_profit(sale.id)
-        total_profit += sale_profit
-        total_revenue += float(sale.total_amount)
+    if filter_type == 'low_stock':
+        conditions.append(Medication.stock_quantity <= low_stock_threshold)
+    elif filter_type == 'expired':
+        conditions.append(Medication.expiry_date < today)
+    elif filter_type == 'expiring_soon':
+        conditions.extend([
+            Medication.expiry_date >= today,
+            Medication.expiry_date <= today + timedelta(days=expiring_days)
+        ])
+    return conditions
+
+def get_inventory_summary(conditions):
+    """Counts and stock value for the filtered medications in one query"""
+    today = datetime.now().date()
+    summary = db.session.query(
+        func.count(Medication.id).label('count'),
+        func.count(Medication.id).filter(Medication.stock_quantity <= 10).label('low_stock'),
+        func.count(Medication.id).filter(Medication.stock_quantity <= 5).label('very_low_stock'),
+        func.count(Medication.id).filter(Medication.expiry_date < today).label('expired'),
+        func.count(Medication.id).filter(
+            Medication.expiry_date >= today,
+            Medication.expiry_date <= today + timedelta(days=30)
+        ).label('expiring_soon'),
+        func.coalesce(func.sum(Medication.price * Medication.stock_quantity), 0).label('total_value')
+    ).filter(*conditions).one()
     
     return {
-        'sales': sales,
-        'total_profit': total_profit,
-        'total_revenue': total_revenue
+        'count': summary.count,
+        'low_stock': summary.low_stock,
+        'very_low_stock': summary.very_low_stock,
+        'expired': summary.expired,
+        'expiring_soon': summary.expiring_soon,
+        'total_value': float(summary.total_value)
+    }
+
+def get_inventory_categories(conditions):
+    """Item count and stock value per category for the filtered medications"""
+    category = func.coalesce(Medication.category, 'Uncategorized')
+    rows = db.session.query(
+        category.label('category'),
+        func.count(Medication.id).label('count'),
+        func.coalesce(func.sum(Medication.price * Medication.stock_quantity), 0).label('value')
+    ).filter(*conditions).group_by(category).order_by(category)
+    return {
+        row.category: {'count': row.count, 'value': float(row.value)}
+        for row in rows
     }
 
-def get_sale_profit(sale_id):
-    from sqlalchemy import func
-    profit = db.session.query(
-        func.coalesce(func.sum(SaleItem.quantity * (SaleItem.unit_price - Medication.cost_price)), 0)
+def get_profit_query(start_date=None, end_date=None):
+    """Completed sales in a date range with their profit, one row per sale"""
+    sales_in_range = filter_sale_date(
+        db.session.query(SaleTransaction.id).filter(SaleTransaction.payment_status == 'completed'),
+        start_date, end_date
+    )
+    # Profit per sale in one grouped pass instead of one query per sale
+    sale_profit = db.session.query(
+        SaleItem.sale_id.label('sale_id'),
+        func.sum(SaleItem.quantity * (SaleItem.unit_price - Medication.cost_price)).label('profit')
     ).join(Medication, SaleItem.medication_id == Medication.id
-    ).filter(SaleItem.sale_id == sale_id).scalar()
+    ).filter(SaleItem.sale_id.in_(sales_in_range)
+    ).group_by(SaleItem.sale_id).subquery()
+    
+    query = db.session.query(
+        SaleTransaction.id,
+        SaleTransaction.transaction_id,
+        SaleTransaction.sale_date,
+        Customer.name,
+        SaleTransaction.total_amount,
+        func.coalesce(sale_profit.c.profit, 0).label('profit'),
+        SaleTransaction.payment_method,
+        User.username
+    ).outerjoin(Customer, SaleTransaction.customer_id == Customer.id
+    ).join(User, SaleTransaction.user_id == User.id
+    ).outerjoin(sale_profit, sale_profit.c.sale_id == SaleTransaction.id
+    ).filter(SaleTransaction.payment_status == 'completed')
+    query = filter_sale_date(query, start_date, end_date)
+    return query.order_by(SaleTransaction.sale_date.desc())
+
+def get_profit_report(start_date=None, end_date=None):
+    sales = analytics_store.execute(get_profit_query(start_date, end_date))
+    profits = [float(sale.profit) for sale in sales]
     
-    return float(profit) if profit else 0
\ No newline at end of file
+    return {
+        'sales': sales,
+        'total_profit': sum(profits),
+        'total_revenue': sum(float(sale.total_amount) for sale in sales),
+        'max_profit': max(profits, default=0),
+        'min_profit': min(profits, default=0),
+        'profitable_count': sum(1 for profit in profits if profit > 0)
+    }
@@ -3,7 +3,8 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for,
 from flask_login import login_required, current_user
 from app import db
 from app.models import Medication, SaleTransaction, SaleItem, Customer
-from app.utils.helpers import get_medications_with_stock, process_sale_transaction, get_sale_details, get_filtered_sales, search_customers
+from app.utils.helpers import get_medications_with_stock, process_sale_transaction, get_sale_details, get_sales_page, get_sales_totals, search_customers, create_customer
+from app.utils.dedup import find_possible_duplicates
 from datetime import datetime
 import json
 
@@ -162,29 +163,37 @@ def print_receipt(sale_id):
 @sales_bp.route('/transactions')
 @login_required
 def transactions():
-    filter_type = request.args.get('filter', 'all')
-    sales = get_filtered_sales(filter_type)
+    filter_type = request.args.get('filter', 'month')
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 25, type=int), 100)
     
-    total_revenue = 0
-    avg_transaction = 0
-    today_revenue = 0
-    
-    if sales:
-        total_revenue = sum(sale.total_amount for sale in sales)
-        # FIX: Prevent ZeroDivisionError if there are no sales
-        if len(sales) > 0:
-            avg_transaction = total_revenue / len(sales)
+    start_date = end_date = None
+    if request.args.get('start_date') and request.args.get('end_date'):
+        try:
+            start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date()
+            end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date()
+            filter_type = 'range'
+        except ValueError:
+            flash('Invalid date format', 'danger')
+            start_date = end_date = None
+    # A range without both dates shows everything, as get_sales_period_condition does
+    if filter_type == 'range' and start_date is None:
+        filter_type = 'all'
     
-    today_sales = get_filtered_sales('today')
-    if today_sales:
-        today_revenue = sum(sale.total_amount for sale in today_sales)
+    totals = get_sales_totals(filter_type, start_date, end_date)
+    pagination = get_sales_page(filter_type, page, per_page, start_date, end_date)
+    pagination.total = totals['count']
     
     return render_template('sales/transactions.html', 
-                           sales=sales, 
+                           sales=pagination.items,
+                           pagination=pagination,
                            filter_type=filter_type,
-                           total_revenue=total_revenue,
-                           avg_transaction=avg_transaction,
-                           today_revenue=today_revenue)
+                           start_date=start_date,
+                           end_date=end_date,
+                           total_count=totals['count'],
+                           total_revenue=totals['revenue'],
+                           avg_transaction=totals['average'],
+                           today_revenue=totals['today_revenue'])
 
 @sales_bp.route('/transaction/<int:sale_id>')
 @login_required
@@ -202,18 +211,10 @@ def view_transaction(sale_id):
 @login_required
 def api_customers_search():
     search_term = request.args.get('q', '')
-    customers = search_customers(search_term) if search_term else Customer.query.order_by(Customer.name).all()
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    customers = search_customers(search_term, limit=limit)
     
-    results = []
-    for customer in customers:
-        results.append({
-            'id': customer.id,
-            'name': customer.name,
-            'phone': customer.phone,
-            'email': customer.email
-        })
-    
-    return jsonify(results)
+    return jsonify([customer.to_dict() for customer in customers])
 
     search_term = request.args.get('q', '').strip()
     query = Customer.query
@@ -247,7 +248,8 @@ def api_customers_add():
                 'name': customer.name,
                 'phone': customer.phone,
                 'email': customer.email
-            }
+            },
+            'possible_duplicates': [duplicate.to_dict() for duplicate in find_possible_duplicates(customer)]
         })
     except Exception as e:
         return jsonify({
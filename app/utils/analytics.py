@@ -0,0 +1,808 @@
+import math
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import numpy as np
+import pandas as pd
+from flask import current_app
+from sqlalchemy import func, case, literal, extract, tuple_, or_, and_, true, cast, Interval, update, Integer, String
+from sqlalchemy.dialects.postgresql import ARRAY
+from app import db
+from app.models import SaleTransaction, SaleItem, Medication, User, Customer
+from app.utils.analytics_store import analytics_store
+
+def get_abc_analysis(start_date, end_date, category=None, a_share=0.8, b_share=0.95):
+    """
+    Rank medications by revenue for a date range and assign ABC classes.
+    Totals, running shares and classes are all computed by one query with
+    window functions, so only one row per medication leaves the database.
+    """
+    medication_totals = db.session.query(
+        Medication.id.label('medication_id'),
+        Medication.name.label('name'),
+        Medication.category.label('category'),
+        func.sum(SaleItem.quantity).label('quantity'),
+        func.sum(SaleItem.total_price).label('revenue'),
+        func.coalesce(func.sum(SaleItem.quantity * (SaleItem.unit_price - Medication.cost_price)), 0).label('margin')
+    ).select_from(SaleItem
+    ).join(SaleTransaction, SaleItem.sale_id == SaleTransaction.id
+    ).join(Medication, SaleItem.medication_id == Medication.id
+    ).filter(
+        SaleTransaction.payment_status == 'completed',
+        SaleTransaction.sale_date >= start_date,
+        SaleTransaction.sale_date < end_date + timedelta(days=1)
+    )
+    if category:
+        medication_totals = medication_totals.filter(Medication.category == category)
+    medication_totals = medication_totals.group_by(Medication.id).subquery()
+
+    revenue = medication_totals.c.revenue
+    total_revenue = func.sum(revenue).over()
+    running_revenue = func.sum(revenue).over(
+        order_by=(revenue.desc(), medication_totals.c.medication_id),
+        rows=(None, 0)
+    )
+    share = revenue / func.nullif(total_revenue, 0)
+    cumulative_share = running_revenue / func.nullif(total_revenue, 0)
+    # An item belongs to the class in which its revenue starts
+    share_before = cumulative_share - share
+
+    ranked = db.session.query(
+        medication_totals,
+        func.coalesce(share, 0).label('share'),
+        func.coalesce(cumulative_share, 0).label('cumulative_share'),
+        case(
+            (share_before < literal(a_share), 'A'),
+            (share_before < literal(b_share), 'B'),
+            else_='C'
+        ).label('abc_class')
+    ).order_by(revenue.desc(), medication_totals.c.medication_id)
+
+    items = []
+    classes = {abc_class: {'count': 0, 'revenue': 0.0, 'quantity': 0} for abc_class in ('A', 'B', 'C')}
+    categories = {}
+
+    for row in analytics_store.execute(ranked):
+        item = {
+            'medication_id': row.medication_id,
+            'name': row.name,
+            'category': row.category or 'Uncategorized',
+            'quantity': int(row.quantity or 0),
+            'revenue': float(row.revenue or 0),
+            'margin': float(row.margin or 0),
+            'share': float(row.share),
+            'cumulative_share': float(row.cumulative_share),
+            'abc_class': row.abc_class
+        }
+        items.append(item)
+
+        class_stats = classes[item['abc_class']]
+        class_stats['count'] += 1
+        class_stats['revenue'] += item['revenue']
+        class_stats['quantity'] += item['quantity']
+
+        category_stats = categories.setdefault(item['category'], {'count': 0, 'revenue': 0.0, 'margin': 0.0, 'A': 0, 'B': 0, 'C': 0})
+        category_stats['count'] += 1
+        category_stats['revenue'] += item['revenue']
+        category_stats['margin'] += item['margin']
+        category_stats[item['abc_class']] += 1
+
+    return {
+        'items': items,
+        'classes': classes,
+        'categories': dict(sorted(categories.items(), key=lambda entry: entry[1]['revenue'], reverse=True)),
+        'total_revenue': sum(item['revenue'] for item in items),
+        'total_margin': sum(item['margin'] for item in items)
+    }
+
+def get_daily_units_matrix(medication_ids, start_date, days):
+    """
+    Build a (medications x days) matrix of completed units sold from one
+    grouped query. Rows follow the order of medication_ids.
+    """
+    day = func.date(SaleTransaction.sale_date)
+    rows = db.session.query(
+        SaleItem.medication_id,
+        day.label('day'),
+        func.sum(SaleItem.quantity).label('units')
+    ).join(SaleTransaction, SaleItem.sale_id == SaleTransaction.id
+    ).filter(
+        SaleTransaction.payment_status == 'completed',
+        SaleTransaction.sale_date >= start_date,
+        SaleTransaction.sale_date < start_date + timedelta(days=days)
+    ).group_by(SaleItem.medication_id, day).all()
+
+    matrix = np.zeros((len(medication_ids), days))
+    if not rows or not len(medication_ids):
+        return matrix
+
+    ids = np.asarray(medication_ids)
+    order = np.argsort(ids)
+    sorted_ids = ids[order]
+
+    sale_ids = np.fromiter((row.medication_id for row in rows), dtype=np.int64, count=len(rows))
+    offsets = np.fromiter(((row.day - start_date).days for row in rows), dtype=np.int64, count=len(rows))
+    units = np.fromiter((row.units for row in rows), dtype=float, count=len(rows))
+
+    positions = np.clip(np.searchsorted(sorted_ids, sale_ids), 0, len(ids) - 1)
+    # Drop sales of medications outside the requested set (e.g. deleted ones)
+    known = sorted_ids[positions] == sale_ids
+    np.add.at(matrix, (order[positions[known]], offsets[known]), units[known])
+    return matrix
+
+def forecast_daily_demand(matrix, method='exponential', window=28, alpha=0.3):
+    """Forecast next-day demand for every row of the matrix at once"""
+    if matrix.shape[1] == 0:
+        return np.zeros(matrix.shape[0])
+
+    if method == 'moving_average':
+        return matrix[:, -window:].mean(axis=1)
+
+    # Simple exponential smoothing: one pass over days, vectorised across medications
+    warmup = min(7, matrix.shape[1])
+    level = matrix[:, :warmup].mean(axis=1)
+    for t in range(warmup, matrix.shape[1]):
+        level = alpha * matrix[:, t] + (1 - alpha) * level
+    return level
+
+def get_demand_forecast(history_days=56, method='exponential', window=28, alpha=0.3,
+                        lead_time_days=7, review_days=7, service_z=1.65):
+    """
+    Forecast demand for every active medication and suggest reorder
+    quantities. Days of cover and stockout dates come from the forecast;
+    the order quantity covers lead time plus the review period with safety
+    stock of service_z standard deviations over the lead time.
+    """
+    today = datetime.now().date()
+    start_date = today - timedelta(days=history_days)
+
+    medications = db.session.query(
+        Medication.id,
+        Medication.name,
+        Medication.category,
+        Medication.stock_quantity,
+        Medication.cost_price
+    ).filter(Medication.deleted == False).order_by(Medication.name).all()
+
+    medication_ids = [med.id for med in medications]
+    matrix = get_daily_units_matrix(medication_ids, start_date, history_days)
+
+    forecast = forecast_daily_demand(matrix, method=method, window=window, alpha=alpha)
+    deviation = matrix[:, -window:].std(axis=1) if history_days else np.zeros(len(medications))
+    stock = np.array([max(med.stock_quantity, 0) for med in medications], dtype=float)
+
+    safety_stock = service_z * deviation * math.sqrt(lead_time_days)
+    reorder_point = forecast * lead_time_days + safety_stock
+    target_stock = forecast * (lead_time_days + review_days) + safety_stock
+    suggested = np.ceil(np.maximum(target_stock - stock, 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_cover = np.where(forecast > 0, stock / forecast, np.inf)
+    units_sold = matrix.sum(axis=1)
+
+    results = []
+    for i, med in enumerate(medications):
+        cover = days_of_cover[i]
+        # Anything beyond ten years of cover has no meaningful stockout date
+        has_stockout = np.isfinite(cover) and cover < 3650
+        results.append({
+            'medication_id': med.id,
+            'name': med.name,
+            'category': med.category or 'Uncategorized',
+            'stock_quantity': med.stock_quantity,
+            'units_sold': int(units_sold[i]),
+            'daily_forecast': float(forecast[i]),
+            'days_of_cover': float(cover) if np.isfinite(cover) else None,
+            'stockout_date': today + timedelta(days=int(cover)) if has_stockout else None,
+            'reorder_point': float(reorder_point[i]),
+            'suggested_quantity': int(suggested[i]),
+            'order_cost': float(suggested[i]) * float(med.cost_price or 0),
+            'needs_reorder': bool(stock[i] <= reorder_point[i] and suggested[i] > 0)
+        })
+
+    results.sort(key=lambda item: (item['days_of_cover'] is None, item['days_of_cover'] or 0))
+    return results
+
+# Time series bucket sizes, finest first, with their approximate length in days
+TIMESERIES_BUCKETS = (
+    ('hour', 1 / 24),
+    ('day', 1),
+    ('week', 7),
+    ('month', 30)
+)
+TIMESERIES_LABELS = {
+    'hour': '%Y-%m-%d %H:00',
+    'day': '%Y-%m-%d',
+    'week': '%Y-%m-%d',
+    'month': '%Y-%m'
+}
+MAX_TIMESERIES_DAYS = 731
+DEFAULT_MAX_POINTS = 200
+
+# Shift name, first hour, hour after the last (store local time); shifts may wrap midnight
+DEFAULT_SHIFTS = (
+    ('Morning', 6, 14),
+    ('Evening', 14, 22),
+    ('Night', 22, 6)
+)
+
+def store_local_sale_date():
+    """
+    sale_date is stored without a time zone in the database server's zone.
+    Convert it to the store's zone when the two differ.
+    """
+    store_tz = current_app.config.get('STORE_TIMEZONE', 'UTC')
+    database_tz = current_app.config.get('DATABASE_TIMEZONE', 'UTC')
+    if store_tz == database_tz:
+        return SaleTransaction.sale_date
+    return func.timezone(store_tz, func.timezone(database_tz, SaleTransaction.sale_date))
+
+def database_time(local_moment):
+    """
+    A naive store-local datetime as the naive database-zone datetime that
+    sale_date is compared with, so date ranges picked in store time filter
+    the same sales the store-local buckets cover.
+    """
+    store_tz = current_app.config.get('STORE_TIMEZONE', 'UTC')
+    database_tz = current_app.config.get('DATABASE_TIMEZONE', 'UTC')
+    if store_tz == database_tz:
+        return local_moment
+    return local_moment.replace(tzinfo=ZoneInfo(store_tz)).astimezone(ZoneInfo(database_tz)).replace(tzinfo=None)
+
+def get_sales_heatmap(start_date, end_date):
+    """
+    Transaction count and revenue by weekday and hour of day for a date
+    range, from one GROUP BY query. Weekdays run Monday (0) to Sunday (6).
+    The dates are days in the store's time zone.
+    """
+    local_date = store_local_sale_date()
+    range_start = datetime.combine(start_date, datetime.min.time())
+    range_end = range_start + timedelta(days=(end_date - start_date).days + 1)
+    weekday = extract('isodow', local_date)
+    hour = extract('hour', local_date)
+
+    rows = db.session.query(
+        weekday.label('weekday'),
+        hour.label('hour'),
+        func.count(SaleTransaction.id).label('transactions'),
+        func.coalesce(func.sum(SaleTransaction.total_amount), 0).label('revenue')
+    ).filter(
+        SaleTransaction.payment_status == 'completed',
+        SaleTransaction.sale_date >= database_time(range_start),
+        SaleTransaction.sale_date < database_time(range_end)
+    ).group_by(weekday, hour).all()
+
+    transactions = [[0] * 24 for _ in range(7)]
+    revenue = [[0.0] * 24 for _ in range(7)]
+    for row in rows:
+        day_index = int(row.weekday) - 1
+        hour_index = int(row.hour)
+        transactions[day_index][hour_index] = row.transactions
+        revenue[day_index][hour_index] = float(row.revenue)
+
+    return {
+        'weekdays': ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
+        'hours': list(range(24)),
+        'transactions': transactions,
+        'revenue': revenue,
+        'max_transactions': max(max(day) for day in transactions),
+        'max_revenue': max(max(day) for day in revenue),
+        'timezone': current_app.config.get('STORE_TIMEZONE', 'UTC')
+    }
+
+def shift_year(day, years):
+    """Same calendar day in another year; 29 February falls back to the 28th"""
+    try:
+        return day.replace(year=day.year + years)
+    except ValueError:
+        return day.replace(year=day.year + years, day=28)
+
+def get_comparison_periods(compare='week', start_date=None, end_date=None):
+    """
+    Current and previous (start, end) date pairs, both inclusive. Preset
+    periods run to today and are compared with the same span earlier on.
+    """
+    today = datetime.now().date()
+
+    if compare == 'month':
+        current = (today.replace(day=1), today)
+        previous_end = current[0] - timedelta(days=1)
+        previous_start = previous_end.replace(day=1)
+        previous = (previous_start, min(previous_start + (today - current[0]), previous_end))
+    elif compare == 'month_last_year':
+        current = (today.replace(day=1), today)
+        previous = (shift_year(current[0], -1), shift_year(today, -1))
+    elif compare == 'custom' and start_date and end_date:
+        current = (start_date, end_date)
+        length = end_date - start_date + timedelta(days=1)
+        previous = (start_date - length, end_date - length)
+    else:
+        week_start = today - timedelta(days=today.weekday())
+        current = (week_start, today)
+        previous = (week_start - timedelta(days=7), today - timedelta(days=7))
+
+    return current, previous
+
+def get_period_comparison(current, previous):
+    """
+    Revenue, units and transactions for two periods, broken down by
+    category, payment method and cashier. One grouped query over both date
+    ranges produces every breakdown plus the totals via GROUPING SETS.
+    The dates are days in the store's time zone.
+    """
+    def in_period(period):
+        range_start = datetime.combine(period[0], datetime.min.time())
+        range_end = datetime.combine(period[1] + timedelta(days=1), datetime.min.time())
+        return and_(
+            SaleTransaction.sale_date >= database_time(range_start),
+            SaleTransaction.sale_date < database_time(range_end)
+        )
+
+    is_current = in_period(current)
+    is_previous = in_period(previous)
+    # Bit set for every grouping column rolled up in this row (category, method, cashier)
+    grouping = func.grouping(Medication.category, SaleTransaction.payment_method, User.username)
+
+    rows = db.session.query(
+        grouping.label('grouping'),
+        Medication.category,
+        SaleTransaction.payment_method,
+        User.username,
+        func.coalesce(func.sum(SaleItem.total_price).filter(is_current), 0).label('current_revenue'),
+        func.coalesce(func.sum(SaleItem.total_price).filter(is_previous), 0).label('previous_revenue'),
+        func.coalesce(func.sum(SaleItem.quantity).filter(is_current), 0).label('current_units'),
+        func.coalesce(func.sum(SaleItem.quantity).filter(is_previous), 0).label('previous_units'),
+        func.count(SaleItem.sale_id.distinct()).filter(is_current).label('current_transactions'),
+        func.count(SaleItem.sale_id.distinct()).filter(is_previous).label('previous_transactions')
+    ).select_from(SaleItem
+    ).join(SaleTransaction, SaleItem.sale_id == SaleTransaction.id
+    ).join(Medication, SaleItem.medication_id == Medication.id
+    ).join(User, SaleTransaction.user_id == User.id
+    ).filter(
+        SaleTransaction.payment_status == 'completed',
+        or_(is_current, is_previous)
+    ).group_by(func.grouping_sets(
+        tuple_(Medication.category),
+        tuple_(SaleTransaction.payment_method),
+        tuple_(User.username),
+        tuple_()
+    )).all()
+
+    dimensions = {'category': [], 'payment_method': [], 'cashier': []}
+    totals = compare_row('Total', None)
+    for row in rows:
+        if row.grouping == 0b011:
+            dimensions['category'].append(compare_row(row.category or 'Uncategorized', row))
+        elif row.grouping == 0b101:
+            dimensions['payment_method'].append(compare_row(row.payment_method or 'Unknown', row))
+        elif row.grouping == 0b110:
+            dimensions['cashier'].append(compare_row(row.username, row))
+        else:
+            totals = compare_row('Total', row)
+
+    for entries in dimensions.values():
+        entries.sort(key=lambda entry: (entry['current_revenue'], entry['previous_revenue']), reverse=True)
+
+    return {
+        'current': {'start_date': current[0].isoformat(), 'end_date': current[1].isoformat()},
+        'previous': {'start_date': previous[0].isoformat(), 'end_date': previous[1].isoformat()},
+        'totals': totals,
+        'dimensions': dimensions
+    }
+
+def compare_row(key, row):
+    entry = {'key': key}
+    for measure in ('revenue', 'units', 'transactions'):
+        current_value = float(getattr(row, f'current_{measure}', 0) or 0)
+        previous_value = float(getattr(row, f'previous_{measure}', 0) or 0)
+        entry[f'current_{measure}'] = current_value
+        entry[f'previous_{measure}'] = previous_value
+        entry[f'{measure}_change'] = current_value - previous_value
+        entry[f'{measure}_change_pct'] = (
+            (current_value - previous_value) / previous_value * 100 if previous_value else None
+        )
+    return entry
+
+def shift_column(hour, shifts):
+    """CASE expression naming the shift an hour of day falls in"""
+    whens = []
+    for name, start, end in shifts:
+        if start < end:
+            whens.append((and_(hour >= start, hour < end), name))
+        else:
+            whens.append((or_(hour >= start, hour < end), name))
+    return case(*whens, else_='Other')
+
+def get_cashier_performance(start_date, end_date, user_id=None):
+    """
+    Per-cashier and per-shift throughput, basket size, discounts and refund
+    rate. Transactions are read once through the (user_id, sale_date) index
+    with their item counts, then rolled up per user and shift and per user
+    in one GROUPING SETS query.
+    """
+    shifts = current_app.config.get('SHIFTS', DEFAULT_SHIFTS)
+    local_date = store_local_sale_date()
+    range_start = datetime.combine(start_date, datetime.min.time())
+    range_end = range_start + timedelta(days=(end_date - start_date).days + 1)
+    in_range = and_(
+        SaleTransaction.sale_date >= database_time(range_start),
+        SaleTransaction.sale_date < database_time(range_end)
+    )
+    user_filter = SaleTransaction.user_id == user_id if user_id else true()
+
+    sale_items = db.session.query(
+        SaleItem.sale_id,
+        func.sum(SaleItem.quantity).label('units')
+    ).join(SaleTransaction, SaleItem.sale_id == SaleTransaction.id
+    ).filter(in_range, user_filter
+    ).group_by(SaleItem.sale_id).subquery()
+
+    sales = db.session.query(
+        SaleTransaction.id,
+        SaleTransaction.user_id,
+        shift_column(extract('hour', local_date), shifts).label('shift'),
+        func.date_trunc('hour', SaleTransaction.sale_date).label('hour'),
+        SaleTransaction.total_amount,
+        func.coalesce(SaleTransaction.discount_amount, 0).label('discount_amount'),
+        SaleTransaction.payment_status,
+        func.coalesce(sale_items.c.units, 0).label('units')
+    ).outerjoin(sale_items, sale_items.c.sale_id == SaleTransaction.id
+    ).filter(in_range, user_filter).subquery()
+
+    completed = sales.c.payment_status == 'completed'
+    rows = db.session.query(
+        func.grouping(sales.c.shift).label('all_shifts'),
+        sales.c.user_id,
+        sales.c.shift,
+        func.count().label('transactions'),
+        func.count().filter(completed).label('completed'),
+        func.count().filter(sales.c.payment_status == 'refunded').label('refunded'),
+        func.count(sales.c.hour.distinct()).label('active_hours'),
+        func.coalesce(func.sum(sales.c.total_amount).filter(completed), 0).label('revenue'),
+        func.coalesce(func.sum(sales.c.units).filter(completed), 0).label('units'),
+        func.coalesce(func.sum(sales.c.discount_amount), 0).label('discounts')
+    ).group_by(func.grouping_sets(
+        tuple_(sales.c.user_id, sales.c.shift),
+        tuple_(sales.c.user_id)
+    )).all()
+
+    usernames = dict(db.session.query(User.id, User.username).filter(
+        User.id.in_({row.user_id for row in rows})
+    ).all()) if rows else {}
+
+    cashiers = {}
+    for row in rows:
+        cashier = cashiers.setdefault(row.user_id, {
+            'user_id': row.user_id,
+            'username': usernames.get(row.user_id, f'User #{row.user_id}'),
+            'totals': None,
+            'shifts': []
+        })
+        stats = cashier_stats(row)
+        if row.all_shifts:
+            cashier['totals'] = stats
+        else:
+            stats['shift'] = row.shift
+            cashier['shifts'].append(stats)
+
+    shift_order = {name: position for position, (name, _, _) in enumerate(shifts)}
+    for cashier in cashiers.values():
+        cashier['shifts'].sort(key=lambda stats: shift_order.get(stats['shift'], len(shift_order)))
+
+    return sorted(cashiers.values(), key=lambda cashier: cashier['totals']['revenue'], reverse=True)
+
+def cashier_stats(row):
+    completed = row.completed or 0
+    return {
+        'transactions': row.transactions,
+        'completed': completed,
+        'refunded': row.refunded,
+        'active_hours': row.active_hours,
+        'transactions_per_hour': row.transactions / row.active_hours if row.active_hours else 0.0,
+        'revenue': float(row.revenue),
+        'average_basket': float(row.revenue) / completed if completed else 0.0,
+        'items_per_transaction': float(row.units) / completed if completed else 0.0,
+        'discounts': float(row.discounts),
+        'refund_rate': row.refunded / row.transactions * 100 if row.transactions else 0.0
+    }
+
+def choose_timeseries_bucket(start_date, end_date, bucket='auto', max_points=DEFAULT_MAX_POINTS):
+    """
+    The requested bucket, or the next coarser one when the range would
+    need more than max_points points. 'auto' picks the finest that fits.
+    """
+    days = (end_date - start_date).days + 1
+    names = [name for name, _ in TIMESERIES_BUCKETS]
+    first = names.index(bucket) if bucket in names else 0
+
+    for name, length in TIMESERIES_BUCKETS[first:]:
+        if days / length <= max_points:
+            return name
+    return names[-1]
+
+def get_sales_timeseries(start_date, end_date, bucket='auto', max_points=DEFAULT_MAX_POINTS):
+    """
+    Completed sales revenue and transaction counts per time bucket between
+    two dates (inclusive). Every bucket in the range is returned, with
+    zeros where nothing was sold: sales are aggregated per bucket and
+    right-joined to a generate_series of bucket starts. Buckets and the
+    dates are in the store's time zone.
+    """
+    chosen = choose_timeseries_bucket(start_date, end_date, bucket, max_points)
+    range_start = datetime.combine(start_date, datetime.min.time())
+    range_end = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1)
+
+    bucket_start = func.date_trunc(chosen, store_local_sale_date())
+    sales = db.session.query(
+        bucket_start.label('bucket'),
+        func.count(SaleTransaction.id).label('transactions'),
+        func.sum(SaleTransaction.total_amount).label('revenue')
+    ).filter(
+        SaleTransaction.payment_status == 'completed',
+        SaleTransaction.sale_date >= database_time(range_start),
+        SaleTransaction.sale_date < database_time(range_end)
+    ).group_by(bucket_start).subquery()
+
+    series = func.generate_series(
+        func.date_trunc(chosen, range_start),
+        range_end - timedelta(microseconds=1),
+        cast(f'1 {chosen}', Interval)
+    ).table_valued('bucket').render_derived()
+
+    rows = db.session.query(
+        series.c.bucket,
+        func.coalesce(sales.c.revenue, 0).label('revenue'),
+        func.coalesce(sales.c.transactions, 0).label('transactions')
+    ).select_from(series
+    ).outerjoin(sales, sales.c.bucket == series.c.bucket
+    ).order_by(series.c.bucket).all()
+
+    label_format = TIMESERIES_LABELS[chosen]
+    return {
+        'bucket': chosen,
+        'requested_bucket': bucket,
+        'downsampled': bucket != 'auto' and chosen != bucket,
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'points': len(rows),
+        'labels': [row.bucket.strftime(label_format) for row in rows],
+        'sales': [float(row.revenue) for row in rows],
+        'transactions': [row.transactions for row in rows]
+    }
+
+# Medications re-based per transaction by refresh_medication_sales_stats
+SALES_STATS_BATCH_SIZE = 500
+
+def medication_sales_targets(now, full=False, medication_ids=None):
+    """
+    Query of the figures refresh_medication_sales_stats gives each
+    medication: id, units_30d, units_90d and last_sold_at. Sales older than
+    90 days are only read for medications without a last_sold_at, or for
+    all of them with full.
+    """
+    completed = SaleTransaction.payment_status == 'completed'
+    window = db.session.query(
+        SaleItem.medication_id.label('medication_id'),
+        func.sum(SaleItem.quantity).filter(SaleTransaction.sale_date >= now - timedelta(days=30)).label('units_30d'),
+        func.sum(SaleItem.quantity).label('units_90d'),
+        func.max(SaleTransaction.sale_date).label('last_sold_at')
+    ).join(SaleTransaction, SaleItem.sale_id == SaleTransaction.id
+    ).filter(completed, SaleTransaction.sale_date >= now - timedelta(days=90))
+
+    history = db.session.query(
+        SaleItem.medication_id.label('medication_id'),
+        func.max(SaleTransaction.sale_date).label('last_sold_at')
+    ).join(SaleTransaction, SaleItem.sale_id == SaleTransaction.id
+    ).filter(completed)
+    if not full:
+        history = history.filter(SaleItem.medication_id.in_(
+            db.session.query(Medication.id).filter(Medication.last_sold_at.is_(None))
+        ))
+
+    targets = db.session.query(Medication.id.label('id'))
+    if medication_ids is not None:
+        window = window.filter(SaleItem.medication_id.in_(medication_ids))
+        history = history.filter(SaleItem.medication_id.in_(medication_ids))
+        targets = targets.filter(Medication.id.in_(medication_ids))
+    window = window.group_by(SaleItem.medication_id).subquery()
+    history = history.group_by(SaleItem.medication_id).subquery()
+
+    # GREATEST skips NULLs, so checkout's own stamp stands until a full rebuild
+    last_sold_at = history.c.last_sold_at if full else func.greatest(
+        Medication.last_sold_at, window.c.last_sold_at, history.c.last_sold_at
+    )
+    return targets.add_columns(
+        func.coalesce(window.c.units_30d, 0).label('units_30d'),
+        func.coalesce(window.c.units_90d, 0).label('units_90d'),
+        last_sold_at.label('last_sold_at')
+    ).outerjoin(window, window.c.medication_id == Medication.id
+    ).outerjoin(history, history.c.medication_id == Medication.id)
+
+def medication_sales_changed(targets):
+    return or_(
+        Medication.units_sold_30d.is_distinct_from(targets.c.units_30d),
+        Medication.units_sold_90d.is_distinct_from(targets.c.units_90d),
+        Medication.last_sold_at.is_distinct_from(targets.c.last_sold_at)
+    )
+
+def refresh_medication_sales_stats(full=False):
+    """
+    Re-base the rolling units_sold_30d/90d counters (which checkout only
+    ever increments) from the last 90 days of completed sales, and look up
+    last_sold_at in the whole history for medications that have none. With
+    full, last_sold_at is rebuilt from the whole history for all of them.
+
+    Only medications whose figures changed are updated, in transactions of
+    SALES_STATS_BATCH_SIZE rows, so the row locks checkout also takes are
+    held briefly. Returns the number of medications updated.
+    """
+    now = datetime.now()
+    targets = medication_sales_targets(now, full).subquery()
+    changed_ids = [row.id for row in db.session.query(Medication.id).join(
+        targets, targets.c.id == Medication.id
+    ).filter(medication_sales_changed(targets)).order_by(Medication.id)]
+
+    updated = 0
+    try:
+        for start in range(0, len(changed_ids), SALES_STATS_BATCH_SIZE):
+            # Recomputed at update time, so sales committed meanwhile count
+            batch = medication_sales_targets(now, full, changed_ids[start:start + SALES_STATS_BATCH_SIZE]).subquery()
+            updated += db.session.execute(
+                update(Medication)
+                .where(Medication.id == batch.c.id, medication_sales_changed(batch))
+                .values(
+                    units_sold_30d=batch.c.units_30d,
+                    units_sold_90d=batch.c.units_90d,
+                    last_sold_at=batch.c.last_sold_at
+                )
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return updated
+
+def get_dead_stock_query(days=90, mode='dead'):
+    """
+    Medications in stock that have not sold in the last days days ('dead'),
+    or whose 90-day sales would take more than twice as long to clear the
+    stock ('slow'). Reads only medication columns through the last_sold_at
+    index; no sales history is aggregated.
+    """
+    cutoff = datetime.now() - timedelta(days=days)
+    query = Medication.query.filter(
+        Medication.deleted == False,
+        Medication.stock_quantity > 0
+    )
+    if mode == 'slow':
+        query = query.filter(
+            Medication.last_sold_at >= cutoff,
+            Medication.stock_quantity > Medication.units_sold_90d * 2
+        )
+    else:
+        query = query.filter(or_(Medication.last_sold_at.is_(None), Medication.last_sold_at < cutoff))
+    return query
+
+def get_dead_stock_summary(days=90, mode='dead'):
+    today = datetime.now().date()
+    stock_value = Medication.stock_quantity * func.coalesce(Medication.cost_price, Medication.price)
+    summary = get_dead_stock_query(days, mode).with_entities(
+        func.count(Medication.id).label('count'),
+        func.coalesce(func.sum(stock_value), 0).label('stock_value'),
+        func.coalesce(func.sum(stock_value).filter(Medication.expiry_date < today), 0).label('expired_value'),
+        func.coalesce(func.sum(stock_value).filter(
+            Medication.expiry_date >= today,
+            Medication.expiry_date <= today + timedelta(days=90)
+        ), 0).label('expiring_value')
+    ).one()
+    return {
+        'count': summary.count,
+        'stock_value': float(summary.stock_value),
+        'expired_value': float(summary.expired_value),
+        'expiring_value': float(summary.expiring_value)
+    }
+
+def get_expiry_risk(medication, today=None):
+    """'expired', 'at_risk' when stock will not sell before expiry at the 90-day rate, else 'ok'"""
+    today = today or datetime.now().date()
+    if not medication.expiry_date:
+        return 'ok'
+    if medication.expiry_date < today:
+        return 'expired'
+    daily_rate = (medication.units_sold_90d or 0) / 90
+    days_left = (medication.expiry_date - today).days
+    if daily_rate == 0 or medication.stock_quantity / daily_rate > days_left:
+        return 'at_risk' if days_left <= 180 else 'ok'
+    return 'ok'
+
+# Segments in display order; the first matching rule wins and customers
+# matching none need attention. Scores run from 1 (bottom fifth of
+# customers) to 5 (top fifth).
+RFM_SEGMENTS = (
+    ('Champions', lambda r, f, m: (r >= 4) & (f >= 4) & (m >= 4)),
+    ('Loyal', lambda r, f, m: (r >= 3) & (f >= 4)),
+    ('Potential Loyalists', lambda r, f, m: (r >= 4) & (f >= 2)),
+    ('New', lambda r, f, m: r >= 4),
+    ("Can't Lose", lambda r, f, m: (r <= 2) & (f >= 4) & (m >= 4)),
+    ('At Risk', lambda r, f, m: (r <= 2) & (f >= 3)),
+    ('Hibernating', lambda r, f, m: r <= 2),
+    ('Need Attention', None),
+)
+
+def quantile_scores(values):
+    """
+    1-5 score per value by its percentile among all values. Ties share the
+    score of the bottom of the tie, so a value held by most customers (one
+    purchase, say) scores low rather than being lifted to the top of its
+    run.
+    """
+    percentiles = pd.Series(values).rank(method='min', pct=True).to_numpy()
+    return np.clip(np.ceil(percentiles * 5), 1, 5).astype(int)
+
+def compute_rfm_segments():
+    """
+    Score every customer with completed purchases on recency, frequency and
+    monetary value and store the scores and segment on the customer.
+    The aggregates come from one grouped query, scoring and segmenting run
+    on whole arrays, and the results are written back in one UPDATE.
+    Returns customer counts per segment.
+    """
+    now = datetime.now()
+    rows = db.session.query(
+        SaleTransaction.customer_id,
+        func.max(SaleTransaction.sale_date).label('last_purchase'),
+        func.count(SaleTransaction.id).label('frequency'),
+        func.sum(SaleTransaction.total_amount).label('monetary')
+    ).filter(
+        SaleTransaction.customer_id.isnot(None),
+        SaleTransaction.payment_status == 'completed'
+    ).group_by(SaleTransaction.customer_id).all()
+
+    try:
+        # Customers without completed purchases have no segment
+        db.session.query(Customer).filter(Customer.rfm_segment.isnot(None)).update(
+            {Customer.rfm_score: None, Customer.rfm_segment: None}, synchronize_session=False
+        )
+        if not rows:
+            db.session.commit()
+            return {}
+
+        frame = pd.DataFrame(rows, columns=['customer_id', 'last_purchase', 'frequency', 'monetary'])
+        recency_days = (now - pd.to_datetime(frame['last_purchase'])).dt.days.to_numpy()
+        # Recent buyers score high, so rank on negated days
+        recency = quantile_scores(-recency_days)
+        frequency = quantile_scores(frame['frequency'].to_numpy())
+        monetary = quantile_scores(frame['monetary'].astype(float).to_numpy())
+
+        names = [name for name, _ in RFM_SEGMENTS]
+        segments = np.select(
+            [rule(recency, frequency, monetary) for _, rule in RFM_SEGMENTS if rule],
+            names[:-1], default=names[-1]
+        )
+        scores = np.char.add(np.char.add(recency.astype(str), frequency.astype(str)), monetary.astype(str))
+
+        # One UPDATE joined to the results passed as three arrays
+        results = func.unnest(
+            cast(frame['customer_id'].astype(int).tolist(), ARRAY(Integer)),
+            cast(scores.tolist(), ARRAY(String)),
+            cast(segments.tolist(), ARRAY(String))
+        ).table_valued('customer_id', 'rfm_score', 'rfm_segment').render_derived()
+        db.session.execute(
+            update(Customer)
+            .where(Customer.id == results.c.customer_id)
+            .values(rfm_score=results.c.rfm_score, rfm_segment=results.c.rfm_segment)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    counts = pd.Series(segments).value_counts()
+    return {name: int(counts.get(name, 0)) for name in names}
+
+def get_rfm_segment_counts():
+    """Customer count per stored segment, in display order, plus unsegmented customers"""
+    counts = dict(db.session.query(Customer.rfm_segment, func.count(Customer.id)).group_by(Customer.rfm_segment).all())
+    segments = [(name, counts.get(name, 0)) for name, _ in RFM_SEGMENTS]
+    segments.append((None, counts.get(None, 0)))
+    return segments
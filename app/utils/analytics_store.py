@@ -0,0 +1,217 @@
+import os
+import threading
+import warnings
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import create_engine, MetaData, Table, Column, Index, BigInteger, String, DateTime, Float, Numeric, select, delete, insert, event, text
+from app import db
+from app.models import User, Customer, Medication, SaleTransaction, SaleItem, RowTombstone
+
+SYNC_BATCH_SIZE = 5000
+
+# Columns copied into the analytics store. Users are limited to what reports
+# display so credentials never leave the primary database.
+MIRRORED_COLUMNS = {
+    User: ('id', 'username', 'role'),
+    Customer: ('id', 'name', 'phone', 'email', 'created_at'),
+    Medication: ('id', 'name', 'generic_name', 'category', 'price', 'cost_price',
+                 'stock_quantity', 'expiry_date', 'created_at', 'deleted'),
+    SaleTransaction: ('id', 'transaction_id', 'customer_id', 'user_id', 'total_amount', 'tax_amount',
+                      'discount_amount', 'payment_method', 'payment_status', 'sale_date'),
+    SaleItem: ('id', 'sale_id', 'medication_id', 'quantity', 'unit_price', 'total_price')
+}
+
+# SQLite keeps numerics as floats; report code converts with float() anyway
+warnings.filterwarnings('ignore', message='Dialect sqlite.*does \\*not\\* support Decimal objects natively')
+
+class AnalyticsStore:
+    """
+    Optional local SQLite copy of the sales tables for heavy read-only
+    reports. Report queries are built against the model tables as usual and
+    executed here instead of on the primary database when the store is
+    enabled (ANALYTICS_STORE_PATH) and has completed a sync.
+    """
+
+    def __init__(self):
+        self.metadata = MetaData()
+        self.tables = {}
+        for model, columns in MIRRORED_COLUMNS.items():
+            source = model.__table__
+            self.tables[model] = Table(source.name, self.metadata, *[
+                Column(name, Float if isinstance(source.c[name].type, Numeric) else source.c[name].type,
+                       primary_key=source.c[name].primary_key)
+                for name in columns
+            ])
+        Index('ix_sale_transactions_sale_date', self.tables[SaleTransaction].c.sale_date)
+        Index('ix_sale_transactions_customer_id', self.tables[SaleTransaction].c.customer_id)
+        Index('ix_sale_items_sale_id', self.tables[SaleItem].c.sale_id)
+        Index('ix_sale_items_medication_id', self.tables[SaleItem].c.medication_id)
+        # Per table, the row_version mark of the snapshot it was last synced from
+        self.sync_marks = Table(
+            'sync_marks', self.metadata,
+            Column('table_name', String(100), primary_key=True),
+            Column('mark', BigInteger, nullable=False),
+            Column('synced_at', DateTime, nullable=True)
+        )
+        self._engines = {}
+        self._engine_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def is_enabled(self):
+        return bool(current_app.config.get('ANALYTICS_STORE_PATH'))
+
+    @property
+    def engine(self):
+        path = current_app.config['ANALYTICS_STORE_PATH']
+        with self._engine_lock:
+            if path not in self._engines:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                engine = create_engine(f'sqlite:///{path}', connect_args={'check_same_thread': False})
+                event.listen(engine, 'connect', configure_connection)
+                self.metadata.create_all(engine)
+                self._engines[path] = engine
+            return self._engines[path]
+
+    def get_status(self):
+        """When the store last synced and how far behind the primary it is"""
+        if not self.is_enabled():
+            return {'enabled': False, 'synced_at': None, 'lag_seconds': None}
+
+        with self.engine.connect() as connection:
+            synced_at = connection.execute(
+                select(self.sync_marks.c.synced_at).where(self.sync_marks.c.table_name == SaleTransaction.__tablename__)
+            ).scalar()
+
+        lag = (datetime.now() - synced_at).total_seconds() if synced_at else None
+        return {'enabled': True, 'synced_at': synced_at, 'lag_seconds': lag, 'syncing': self._sync_lock.locked()}
+
+    def is_ready(self):
+        return self.is_enabled() and self.get_status()['synced_at'] is not None
+
+    def execute(self, query):
+        """
+        Run a report query on the store when it is ready, otherwise on the
+        primary database. Stale and never-synced stores trigger a
+        background sync.
+        """
+        if not self.is_enabled():
+            return query.all()
+
+        self.sync_if_stale()
+        if not self.is_ready():
+            return query.all()
+
+        with self.engine.connect() as connection:
+            return connection.execute(query.statement).all()
+
+    def sync_if_stale(self):
+        interval = current_app.config.get('ANALYTICS_SYNC_INTERVAL', 300)
+        lag = self.get_status()['lag_seconds']
+        if lag is not None and lag < interval:
+            return
+        if self._sync_lock.locked():
+            return
+
+        app = current_app._get_current_object()
+        def run():
+            with app.app_context():
+                try:
+                    self.sync()
+                except Exception as e:
+                    app.logger.warning(f'Analytics store sync failed: {str(e)}')
+        threading.Thread(target=run, name='analytics-store-sync', daemon=True).start()
+
+    def sync(self):
+        """
+        Bring the store up to date from one consistent snapshot of the
+        primary database. Rows stamped with a row_version at or after a
+        table's last mark replace their copies, and rows tombstoned since
+        are deleted, so inserts, updates and deletes all arrive however old
+        the row is. A table is copied in full on its first sync, after it
+        was truncated or restored, and when a full backup pruned tombstones
+        the store hadn't applied yet. Returns rows copied per table.
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            return None
+
+        try:
+            started_at = datetime.now()
+            copied = {}
+
+            source = db.engine.connect().execution_options(isolation_level='REPEATABLE READ', postgresql_readonly=True)
+            with source, self.engine.begin() as connection:
+                # Taken by the snapshot's first statement; see SnapshotExport
+                mark = source.execute(text('SELECT txid_snapshot_xmin(txid_current_snapshot())')).scalar()
+                marks = dict(connection.execute(
+                    select(self.sync_marks.c.table_name, self.sync_marks.c.mark)
+                ).all())
+
+                for model in MIRRORED_COLUMNS:
+                    target = self.tables[model]
+                    since = marks.get(target.name)
+                    if since is not None and self.needs_full_copy(source, target.name, since):
+                        since = None
+
+                    if since is None:
+                        connection.execute(delete(target))
+                    else:
+                        self.delete_tombstoned(source, connection, target, since)
+                    copied[target.name] = self.copy_rows(source, connection, model, since)
+                    self.save_mark(connection, target.name, mark, started_at)
+
+            return copied
+        finally:
+            self._sync_lock.release()
+
+    def needs_full_copy(self, source, table_name, since):
+        """Truncates aren't tombstoned row by row, and pruned tombstones can't be replayed"""
+        return source.execute(select(RowTombstone.id).where(
+            RowTombstone.row_version >= since,
+            RowTombstone.row_id.is_(None),
+            RowTombstone.table_name.in_((table_name, RowTombstone.PRUNED))
+        ).limit(1)).first() is not None
+
+    def delete_tombstoned(self, source, connection, target, since):
+        ids = source.execute(select(RowTombstone.row_id).where(
+            RowTombstone.table_name == target.name,
+            RowTombstone.row_version >= since,
+            RowTombstone.row_id.is_not(None)
+        )).scalars().all()
+        for start in range(0, len(ids), SYNC_BATCH_SIZE):
+            connection.execute(delete(target).where(target.c.id.in_(ids[start:start + SYNC_BATCH_SIZE])))
+
+    def copy_rows(self, source, connection, model, since):
+        """
+        Stream rows from the primary database into the store in batches,
+        all of them or those written since the mark, over older copies
+        """
+        target = self.tables[model]
+        columns = [model.__table__.c[column.name] for column in target.columns]
+        query = select(*columns).order_by(model.id)
+        if since is not None:
+            query = query.where(model.row_version >= since)
+
+        count = 0
+        result = source.execute(query.execution_options(yield_per=SYNC_BATCH_SIZE))
+        for batch in result.partitions():
+            rows = [dict(row._mapping) for row in batch]
+            if since is not None:
+                connection.execute(delete(target).where(target.c.id.in_([row['id'] for row in rows])))
+            connection.execute(insert(target), rows)
+            count += len(rows)
+        return count
+
+    def save_mark(self, connection, table_name, mark, synced_at):
+        connection.execute(delete(self.sync_marks).where(self.sync_marks.c.table_name == table_name))
+        connection.execute(insert(self.sync_marks).values(
+            table_name=table_name, mark=mark, synced_at=synced_at
+        ))
+
+def configure_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # Readers keep working while a sync writes
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+analytics_store = AnalyticsStore()
@@ -0,0 +1,649 @@
+import io
+import os
+import gzip
+import json
+import time
+import hashlib
+import tempfile
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import text, func, cast, literal, Float, Text
+from app import db
+from app.models import User, Medication, SaleTransaction, SaleItem, Customer, RowTombstone
+from app.utils.exports import stream_rows, iter_file_chunks
+from app.utils.cache import cache
+from app.utils.analytics import refresh_medication_sales_stats
+
+# Rows per server-side cursor fetch, and per compressed write
+BACKUP_CHUNK_SIZE = 5000
+
+# gzip's own default; level 9 costs several times the CPU for a few percent
+BACKUP_COMPRESS_LEVEL = 6
+
+BACKUP_FORMAT = 'ndjson-gzip'
+BACKUP_FORMAT_VERSION = 1
+
+MANIFEST_NAME = 'manifest.json'
+
+# Tables in backup and restore order, parents before the tables referencing them
+BACKUP_TABLE_NAMES = ['users', 'medications', 'customers', 'sale_transactions', 'sale_items']
+
+# Rows per COPY into the restore staging tables
+RESTORE_CHUNK_SIZE = 10000
+
+class BackupError(Exception):
+    """A backup that is incomplete, corrupt or inconsistent"""
+
+def get_backup_dir():
+    return current_app.config.get('BACKUP_DIR') or os.path.join(current_app.instance_path, 'backups')
+
+def json_lines(model, since, **fields):
+    """
+    Query of model's rows, in id order, each as one line of JSON text with
+    fields as its keys. The database builds the JSON, so parallel dumps
+    spread that work over its cores.
+    """
+    pairs = [part for name, column in fields.items() for part in (literal(name), column)]
+    query = db.session.query(
+        cast(func.json_build_object(*pairs), Text).label('line')
+    ).select_from(model).order_by(model.id)
+    return query if since is None else query.filter(model.row_version >= since)
+
+def get_backup_tables(since=None):
+    """
+    (name, query) for each table in backup order; each query yields rows
+    as JSON text. With since, only rows written by transaction since or
+    later are included, followed by the tombstones of rows deleted since.
+    """
+    tables = [
+        ('users', json_lines(
+            User, since,
+            id=User.id,
+            username=User.username,
+            email=User.email,
+            password_hash=User.password_hash,
+            role=User.role,
+            created_at=User.created_at,
+            is_active=User.is_active,
+            is_approved=User.is_approved
+        )),
+        ('medications', json_lines(
+            Medication, since,
+            id=Medication.id,
+            name=Medication.name,
+            generic_name=Medication.generic_name,
+            manufacturer=Medication.manufacturer,
+            price=cast(Medication.price, Float),
+            cost_price=cast(Medication.cost_price, Float),
+            stock_quantity=Medication.stock_quantity,
+            expiry_date=Medication.expiry_date,
+            category=Medication.category,
+            barcode=Medication.barcode,
+            created_at=Medication.created_at,
+            deleted=Medication.deleted
+        )),
+        ('customers', json_lines(
+            Customer, since,
+            id=Customer.id,
+            name=Customer.name,
+            phone=Customer.phone,
+            email=Customer.email,
+            address=Customer.address,
+            created_at=Customer.created_at
+        )),
+        ('sale_transactions', json_lines(
+            SaleTransaction, since,
+            id=SaleTransaction.id,
+            transaction_id=SaleTransaction.transaction_id,
+            customer_id=SaleTransaction.customer_id,
+            user_id=SaleTransaction.user_id,
+            total_amount=cast(SaleTransaction.total_amount, Float),
+            tax_amount=cast(func.coalesce(SaleTransaction.tax_amount, 0), Float),
+            discount_amount=cast(func.coalesce(SaleTransaction.discount_amount, 0), Float),
+            payment_method=SaleTransaction.payment_method,
+            payment_status=SaleTransaction.payment_status,
+            sale_date=SaleTransaction.sale_date,
+            notes=SaleTransaction.notes
+        )),
+        ('sale_items', json_lines(
+            SaleItem, since,
+            id=SaleItem.id,
+            sale_id=SaleItem.sale_id,
+            medication_id=SaleItem.medication_id,
+            quantity=SaleItem.quantity,
+            unit_price=cast(SaleItem.unit_price, Float),
+            total_price=cast(SaleItem.total_price, Float)
+        )),
+    ]
+    if since is not None:
+        tables.append(('tombstones', db.session.query(
+            cast(func.json_build_object(
+                literal('table_name'), RowTombstone.table_name, literal('row_id'), RowTombstone.row_id
+            ), Text).label('line')
+        ).filter(RowTombstone.row_version >= since).order_by(RowTombstone.id)))
+    return tables
+
+def table_file_name(table_name):
+    return f'{table_name}.ndjson.gz'
+
+class HashingWriter:
+    """Write-through wrapper that keeps a SHA-256 and byte count of everything written"""
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        pass
+
+class StreamSink(io.RawIOBase):
+    """
+    Unseekable file that collects written bytes until drained, so a zip
+    archive can be produced piece by piece inside a response generator.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def iter_table_dump(query, fileobj, stats):
+    """
+    Write the JSON lines of query to fileobj as gzip-compressed NDJSON.
+    Yields after every chunk so a streaming caller can pass the compressed
+    bytes on; once exhausted, stats holds the row count and the size and
+    SHA-256 of the compressed file.
+    """
+    writer = HashingWriter(fileobj)
+    rows = 0
+    with gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=BACKUP_COMPRESS_LEVEL, mtime=0) as output:
+        lines = []
+        for row in stream_rows(query, BACKUP_CHUNK_SIZE):
+            lines.append(row.line)
+            rows += 1
+            if len(lines) == BACKUP_CHUNK_SIZE:
+                output.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                lines.clear()
+                yield
+        if lines:
+            output.write(('\n'.join(lines) + '\n').encode('utf-8'))
+    stats.update(rows=rows, bytes=writer.size, sha256=writer.sha256.hexdigest())
+    yield
+
+class SnapshotExport:
+    """
+    A consistent, read-only view of the whole database shared by several
+    worker threads. On enter a REPEATABLE READ READ ONLY transaction is
+    opened and its snapshot exported; each task passed to submit runs on
+    its own pooled connection in a transaction that imports that snapshot,
+    so tables dumped in parallel all see the same committed state and a
+    sale item never appears without its sale. The exporting transaction
+    stays open until every task has finished.
+
+    mark is the id of the oldest transaction running when the snapshot was
+    taken: every change the snapshot doesn't see is stamped with this id or
+    a later one, so the next incremental backup exports rows from here on.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers or current_app.config.get('BACKUP_WORKERS', 4)
+
+    def __enter__(self):
+        self.app = current_app._get_current_object()
+        self.connection = db.engine.connect().execution_options(
+            isolation_level='REPEATABLE READ', postgresql_readonly=True
+        )
+        try:
+            self.snapshot_id = self.connection.execute(text('SELECT pg_export_snapshot()')).scalar()
+            self.mark = self.connection.execute(text('SELECT txid_snapshot_xmin(txid_current_snapshot())')).scalar()
+        except Exception:
+            self.connection.close()
+            raise
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='backup')
+        return self
+
+    def submit(self, task, *args):
+        def run():
+            with self.app.app_context():
+                connection = db.session.connection(execution_options={
+                    'isolation_level': 'REPEATABLE READ', 'postgresql_readonly': True
+                })
+                connection.execute(text('SET TRANSACTION SNAPSHOT :snapshot_id'), {'snapshot_id': self.snapshot_id})
+                return task(*args)
+        return self.executor.submit(run)
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.connection.close()
+
+def write_table_file(table_name, since, directory):
+    """Dump one table of get_backup_tables(since) into directory; returns its manifest entry"""
+    query = dict(get_backup_tables(since))[table_name]
+    stats = {}
+    with open(os.path.join(directory, table_file_name(table_name)), 'wb') as output:
+        for _ in iter_table_dump(query, output, stats):
+            pass
+    return {'name': table_name, 'file': table_file_name(table_name), **stats}
+
+def new_manifest(backup_type='full', mark=None):
+    return {
+        'format': BACKUP_FORMAT,
+        'version': BACKUP_FORMAT_VERSION,
+        'type': backup_type,
+        'created_at': datetime.now().isoformat(),
+        'mark': mark,
+        'tables': []
+    }
+
+def read_saved_manifest(name, directory=None):
+    with open(os.path.join(directory or get_backup_dir(), name, MANIFEST_NAME)) as manifest_file:
+        return json.load(manifest_file)
+
+def write_backup(directory=None, mode='auto'):
+    """
+    Write a backup to a new timestamped folder under directory (BACKUP_DIR
+    by default): one gzip NDJSON file per table, dumped in parallel from
+    one snapshot, and a manifest with row counts and checksums. Returns
+    the folder path and the manifest.
+
+    A full backup holds every row. An incremental one holds the rows
+    changed since the latest saved backup and tombstones for the rows
+    deleted since, and names that backup as its previous link. In auto
+    mode backups are incremental until BACKUP_MAX_CHAIN of them follow the
+    last full one, then a new full base is taken.
+    """
+    directory = directory or get_backup_dir()
+    saved = list_saved_backups(directory)
+    previous_name = saved[0] if saved else None
+    previous = read_saved_manifest(previous_name, directory) if previous_name else None
+    can_chain = previous is not None and previous.get('mark') is not None
+
+    # Truncates aren't tombstoned row by row, so they break the chain
+    truncated = can_chain and db.session.query(RowTombstone.table_name).filter(
+        RowTombstone.row_version >= previous['mark'], RowTombstone.row_id.is_(None)
+    ).first()
+
+    if mode == 'auto':
+        max_chain = current_app.config.get('BACKUP_MAX_CHAIN', 6)
+        chain_ok = can_chain and not truncated and previous.get('chain_length', 0) < max_chain
+        mode = 'incremental' if chain_ok else 'full'
+
+    since = None
+    if mode == 'incremental':
+        if not can_chain:
+            raise BackupError('There is no saved backup to build an incremental backup on. Take a full backup first.')
+        if truncated and truncated.table_name == RowTombstone.PRUNED:
+            raise BackupError('A full backup saved elsewhere has pruned the deletes since the last backup. Take a full backup.')
+        if truncated:
+            raise BackupError(f'{truncated.table_name} was emptied or restored since the last backup. Take a full backup.')
+        since = previous['mark']
+
+    path = os.path.join(directory, f'backup_{datetime.now().strftime("%Y%m%d_%H%M%S_%f")}_{mode}')
+    os.makedirs(path)
+    with SnapshotExport() as snapshot:
+        mark = snapshot.mark
+        manifest = new_manifest(mode, mark)
+        if mode == 'incremental':
+            manifest.update(
+                previous=previous_name,
+                base=previous.get('base') or previous_name,
+                chain_length=previous.get('chain_length', 0) + 1,
+                since=since
+            )
+        futures = [
+            snapshot.submit(write_table_file, table_name, since, path)
+            for table_name, _ in get_backup_tables(since)
+        ]
+        manifest['tables'] = [future.result() for future in futures]
+
+    # Written last, so a folder with a manifest is a complete backup
+    with open(os.path.join(path, MANIFEST_NAME), 'w') as output:
+        json.dump(manifest, output, indent=2)
+
+    if mode == 'full':
+        # Later incremental backups all build on this one or newer. The
+        # marker sits just below the mark, where chains from here don't see it
+        db.session.query(RowTombstone).filter(RowTombstone.row_version < mark).delete(synchronize_session=False)
+        db.session.add(RowTombstone(table_name=RowTombstone.PRUNED, row_version=mark - 1))
+        db.session.commit()
+    return path, manifest
+
+def iter_backup_archive():
+    """
+    Yield a zip archive holding the same files as a full write_backup.
+    Tables are dumped in parallel from one snapshot into scratch files and
+    each is streamed into the archive, in order, as soon as it is done.
+    Table files are stored as they are (they are already compressed) and
+    the manifest comes last, once every checksum is known.
+    """
+    sink = StreamSink()
+    with tempfile.TemporaryDirectory() as scratch, SnapshotExport() as snapshot:
+        manifest = new_manifest(mark=snapshot.mark)
+        futures = [
+            snapshot.submit(write_table_file, table_name, None, scratch)
+            for table_name, _ in get_backup_tables()
+        ]
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for future in futures:
+                entry = future.result()
+                with open(os.path.join(scratch, entry['file']), 'rb') as table_file, \
+                        archive.open(entry['file'], 'w', force_zip64=True) as member:
+                    for chunk in iter_file_chunks(table_file):
+                        member.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                manifest['tables'].append(entry)
+            archive.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+    yield sink.drain()
+
+class HashingReader:
+    """Read-through wrapper that keeps a SHA-256 and byte count of everything read"""
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
+
+class BackupReader:
+    """
+    Reads a backup made by write_backup (a folder) or iter_backup_archive
+    (a zip file path or file object). Rows are decompressed as they are
+    iterated, and each table file is checked against the manifest once it
+    has been read to the end.
+    """
+    def __init__(self, source):
+        if isinstance(source, str) and os.path.isdir(source):
+            self.path, self.archive = source, None
+        else:
+            self.path = None
+            try:
+                self.archive = zipfile.ZipFile(source)
+            except zipfile.BadZipFile:
+                raise BackupError('Backup is not a zip archive.')
+
+        try:
+            with self.open(MANIFEST_NAME) as manifest_file:
+                self.manifest = json.load(manifest_file)
+        except (KeyError, FileNotFoundError):
+            raise BackupError(f'Backup has no {MANIFEST_NAME}.')
+        if self.manifest.get('format') != BACKUP_FORMAT or self.manifest.get('version', 0) > BACKUP_FORMAT_VERSION:
+            raise BackupError('Backup format is not supported by this version.')
+        self.tables = {table['name']: table for table in self.manifest['tables']}
+
+    def open(self, name):
+        if self.archive is not None:
+            return self.archive.open(name)
+        return open(os.path.join(self.path, name), 'rb')
+
+    def iter_rows(self, table_name):
+        """Rows of a table as dicts; raises BackupError if the file doesn't match the manifest"""
+        entry = self.tables.get(table_name)
+        if entry is None:
+            raise BackupError(f'Backup is missing the {table_name} table.')
+
+        rows = 0
+        with self.open(entry['file']) as raw:
+            reader = HashingReader(raw)
+            with gzip.GzipFile(fileobj=reader, mode='rb') as lines:
+                for line in lines:
+                    rows += 1
+                    yield json.loads(line)
+            reader.read()
+
+        if reader.sha256.hexdigest() != entry['sha256'] or rows != entry['rows']:
+            raise BackupError(f'{entry["file"]} does not match the backup manifest.')
+
+class LegacyJsonReader:
+    """
+    Reads a .json backup in the format written before backups became
+    archives: one list of row dicts per table, with ids. That format left
+    out the user named admin, so the restore keeps the current admin, under
+    an id the backup doesn't use, and points the sales of the backup's
+    missing user ids at it. Offers the same manifest, tables and iter_rows
+    as BackupReader, so restore_backup takes either.
+    """
+    def __init__(self, fileobj):
+        try:
+            data = json.load(fileobj)
+        except ValueError:
+            raise BackupError('Backup is not valid JSON.')
+        if not isinstance(data, dict):
+            raise BackupError('Backup is not valid JSON.')
+        for table_name in BACKUP_TABLE_NAMES:
+            if not isinstance(data.get(table_name), list):
+                raise BackupError(f'Invalid backup file: missing {table_name} data')
+
+        # The oldest backups have no user ids; number them in file order as their restore did
+        users = [dict(row, id=row.get('id', number)) for number, row in enumerate(data['users'])]
+        user_ids = {row['id'] for row in users}
+        admin = User.query.filter_by(username='admin').first()
+        if admin is not None and not any(row.get('username') == 'admin' for row in users):
+            admin_id = admin.id if admin.id not in user_ids else max(user_ids) + 1
+            users.insert(0, {
+                'id': admin_id,
+                'username': admin.username,
+                'email': admin.email,
+                'password_hash': admin.password_hash,
+                'role': admin.role,
+                'created_at': admin.created_at,
+                'is_active': admin.is_active,
+                'is_approved': admin.is_approved
+            })
+            for row in data['sale_transactions']:
+                if row.get('user_id') not in user_ids:
+                    row['user_id'] = admin_id
+        data['users'] = users
+
+        self.data = data
+        self.manifest = {'type': 'full'}
+        self.tables = {table_name: {'rows': len(data[table_name])} for table_name in BACKUP_TABLE_NAMES}
+
+    def iter_rows(self, table_name):
+        return iter(self.data[table_name])
+
+def get_restore_columns(table, row):
+    """
+    Columns a restore writes: those present in the backup's rows, except
+    database-computed ones. Columns the backup leaves out, such as derived
+    sales statistics, take their defaults.
+    """
+    return [column.name for column in table.columns if column.computed is None and column.name in row]
+
+def copy_value(value):
+    """A value in COPY text format: \\N for NULL, with backslashes and line breaks escaped"""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def copy_rows(cursor, table_name, columns, rows):
+    """Load dict rows into table_name with one COPY"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(row.get(column)) for column in columns))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY {table_name} ({", ".join(columns)}) FROM STDIN', buffer)
+
+def find_missing_references(connection, table_name, table):
+    """Bulk check of each foreign key of a staged table against its staged parent"""
+    problems = []
+    for foreign_key in table.foreign_keys:
+        column = foreign_key.parent.name
+        parent = foreign_key.column
+        missing = connection.execute(text(
+            f'SELECT count(*), (array_agg(DISTINCT child.{column}))[1:5] '
+            f'FROM restore_{table_name} child '
+            f'WHERE child.{column} IS NOT NULL AND NOT EXISTS ('
+            f'SELECT 1 FROM restore_{parent.table.name} parent WHERE parent.{parent.name} = child.{column})'
+        )).one()
+        if missing[0]:
+            problems.append(
+                f'{missing[0]} {table_name} rows reference missing {parent.table.name} '
+                f'(e.g. {column} {", ".join(str(value) for value in missing[1])})'
+            )
+    return problems
+
+def log_restore_progress(table_name, loaded, total):
+    current_app.logger.info('Restoring %s: %d of %s rows', table_name, loaded, total)
+
+def list_saved_backups(directory=None):
+    """Names of complete backups under directory (BACKUP_DIR by default), newest first"""
+    directory = directory or get_backup_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        (name for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name, MANIFEST_NAME))),
+        reverse=True
+    )
+
+def load_backup_chain(name, directory=None):
+    """Readers for a saved backup and, if it is incremental, every backup it builds on, full base first"""
+    directory = directory or get_backup_dir()
+    saved = set(list_saved_backups(directory))
+    chain = []
+    while True:
+        if name not in saved:
+            raise BackupError(f'Backup {name} is missing, so the backups built on it cannot be restored.')
+        reader = BackupReader(os.path.join(directory, name))
+        chain.append(reader)
+        if reader.manifest.get('type', 'full') == 'full':
+            return chain[::-1]
+        name = reader.manifest['previous']
+
+def stage_table(connection, cursor, reader, table_name, stage_name, progress):
+    """
+    COPY a table from a backup into a new temporary table in chunks.
+    Returns the columns loaded, or None if the table was empty.
+    """
+    table = db.Model.metadata.tables[table_name]
+    total = reader.tables.get(table_name, {}).get('rows')
+    connection.execute(text(f'CREATE TEMP TABLE {stage_name} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP'))
+
+    columns = None
+    loaded = 0
+    chunk = []
+    for row in reader.iter_rows(table_name):
+        if columns is None:
+            columns = get_restore_columns(table, row)
+        chunk.append(row)
+        if len(chunk) == RESTORE_CHUNK_SIZE:
+            copy_rows(cursor, stage_name, columns, chunk)
+            loaded += len(chunk)
+            chunk = []
+            progress(table_name, loaded, total)
+    if chunk:
+        copy_rows(cursor, stage_name, columns, chunk)
+        loaded += len(chunk)
+    progress(table_name, loaded, total)
+    return columns
+
+def restore_backup(reader, increments=(), progress=None):
+    """
+    Replace all data with a full backup, plus any incremental backups
+    built on it in order, keeping the original ids.
+
+    Each table is COPY'd in chunks into a temporary staging table. Each
+    increment is staged the same way and merged in: changed rows replace
+    their staged versions and tombstoned rows are removed. Foreign keys are
+    then checked across the staged tables with one anti-join per key, and
+    only then are the live tables truncated and filled from staging and
+    their id sequences moved past the restored ids. Everything happens in
+    one transaction, so a bad backup leaves the database untouched.
+    Medication sales statistics are rebuilt from the restored sales after.
+    progress is called with (table name, rows loaded, rows in table) after
+    each chunk and logs by default. Returns the row count of each table.
+    """
+    if reader.manifest.get('type', 'full') != 'full':
+        raise BackupError('This is an incremental backup. Restore it from the saved backups so its full base is found.')
+
+    progress = progress or log_restore_progress
+    metadata = db.Model.metadata
+    connection = db.session.connection()
+    cursor = connection.connection.cursor()
+    columns = {}
+    counts = {}
+    started_at = time.monotonic()
+
+    try:
+        for table_name in BACKUP_TABLE_NAMES:
+            table_columns = stage_table(connection, cursor, reader, table_name, f'restore_{table_name}', progress)
+            if table_columns:
+                columns[table_name] = table_columns
+
+        for number, increment in enumerate(increments):
+            for table_name in BACKUP_TABLE_NAMES:
+                stage_name = f'restore_changes_{number}_{table_name}'
+                changed_columns = stage_table(connection, cursor, increment, table_name, stage_name, progress)
+                if not changed_columns:
+                    continue
+                column_list = ', '.join(changed_columns)
+                connection.execute(text(f'DELETE FROM restore_{table_name} WHERE id IN (SELECT id FROM {stage_name})'))
+                connection.execute(text(
+                    f'INSERT INTO restore_{table_name} ({column_list}) SELECT {column_list} FROM {stage_name}'
+                ))
+                columns.setdefault(table_name, changed_columns)
+
+            deleted = defaultdict(list)
+            for row in increment.iter_rows('tombstones'):
+                if row['table_name'] in BACKUP_TABLE_NAMES and row['row_id'] is not None:
+                    deleted[row['table_name']].append(row['row_id'])
+            for table_name, ids in deleted.items():
+                connection.execute(text(f'DELETE FROM restore_{table_name} WHERE id = ANY(:ids)'), {'ids': ids})
+
+        problems = []
+        for table_name in BACKUP_TABLE_NAMES:
+            problems.extend(find_missing_references(connection, table_name, metadata.tables[table_name]))
+        if problems:
+            raise BackupError('Backup is inconsistent: ' + '; '.join(problems))
+
+        connection.execute(text(f'TRUNCATE {", ".join(BACKUP_TABLE_NAMES)}'))
+        for table_name in BACKUP_TABLE_NAMES:
+            if table_name in columns:
+                column_list = ', '.join(columns[table_name])
+                counts[table_name] = connection.execute(text(
+                    f'INSERT INTO {table_name} ({column_list}) SELECT {column_list} FROM restore_{table_name}'
+                )).rowcount
+            else:
+                counts[table_name] = 0
+            connection.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), "
+                f"coalesce((SELECT max(id) FROM {table_name}), 0) + 1, false)"
+            ))
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    cache.invalidate()
+    refresh_medication_sales_stats(full=True)
+    elapsed = time.monotonic() - started_at
+    current_app.logger.info(
+        'Restored %d rows in %.1fs: %s', sum(counts.values()), elapsed,
+        ', '.join(f'{table_name}={count}' for table_name, count in counts.items())
+    )
+    return counts
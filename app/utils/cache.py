@@ -0,0 +1,56 @@
+import threading
+import time
+
+class TTLCache:
+    """
+    Small in-process cache with per-key expiry and single-flight: when an
+    entry is missing or stale, the first caller computes it and concurrent
+    callers for the same key wait for that result instead of recomputing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._flights = {}
+
+    def get_or_compute(self, key, compute, ttl):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                return entry[0]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = {'event': threading.Event(), 'value': None, 'error': None}
+                self._flights[key] = flight
+
+        if not leader:
+            flight['event'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            return flight['value']
+
+        try:
+            value = compute()
+            flight['value'] = value
+            with self._lock:
+                self._entries[key] = (value, time.monotonic() + ttl)
+            return value
+        except Exception as e:
+            flight['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight['event'].set()
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+# Shared by all requests handled by this worker
+cache = TTLCache()
@@ -0,0 +1,125 @@
+from sqlalchemy import text
+from app import db
+
+# Slow statements listed from pg_stat_statements
+SLOW_STATEMENT_LIMIT = 10
+
+# Dead tuples above this share of a table suggest vacuum is falling behind
+DEAD_TUPLE_WARNING_RATIO = 0.2
+
+def get_table_stats():
+    """
+    Estimated row count, sizes, scans and dead tuples of each user table,
+    from the planner's statistics rather than COUNT(*). pg_class.reltuples
+    is what ANALYZE last measured (-1 if never analyzed, where the live
+    tuple counter is used instead).
+    """
+    rows = db.session.execute(text("""
+        SELECT c.relname AS table_name,
+               CASE WHEN c.reltuples < 0 THEN s.n_live_tup ELSE c.reltuples::bigint END AS estimated_rows,
+               s.n_live_tup AS live_tuples,
+               s.n_dead_tup AS dead_tuples,
+               pg_relation_size(c.oid) AS table_bytes,
+               pg_indexes_size(c.oid) AS index_bytes,
+               pg_total_relation_size(c.oid) AS total_bytes,
+               s.seq_scan,
+               s.idx_scan,
+               greatest(s.last_vacuum, s.last_autovacuum) AS last_vacuum,
+               greatest(s.last_analyze, s.last_autoanalyze) AS last_analyze
+        FROM pg_class c
+        JOIN pg_stat_user_tables s ON s.relid = c.oid
+        WHERE s.schemaname = current_schema()
+        ORDER BY pg_total_relation_size(c.oid) DESC
+    """)).mappings().all()
+
+    tables = []
+    for row in rows:
+        table = dict(row)
+        tracked = (row['live_tuples'] or 0) + (row['dead_tuples'] or 0)
+        table['dead_ratio'] = (row['dead_tuples'] or 0) / tracked if tracked else 0
+        table['needs_vacuum'] = table['dead_ratio'] > DEAD_TUPLE_WARNING_RATIO
+        tables.append(table)
+    return tables
+
+def get_index_stats():
+    """Size and scan count of each user index; indexes never scanned are candidates to drop"""
+    rows = db.session.execute(text("""
+        SELECT s.relname AS table_name,
+               s.indexrelname AS index_name,
+               s.idx_scan,
+               s.idx_tup_read,
+               pg_relation_size(s.indexrelid) AS index_bytes,
+               i.indisunique AS is_unique,
+               i.indisprimary AS is_primary
+        FROM pg_stat_user_indexes s
+        JOIN pg_index i ON i.indexrelid = s.indexrelid
+        WHERE s.schemaname = current_schema()
+        ORDER BY pg_relation_size(s.indexrelid) DESC
+    """)).mappings().all()
+
+    # Unique and primary key indexes enforce constraints, so they earn their keep unscanned
+    return [dict(row, unused=row['idx_scan'] == 0 and not row['is_unique']) for row in rows]
+
+def get_cache_hit_ratios():
+    """Share of table and index block reads served from shared buffers, None before any reads"""
+    row = db.session.execute(text("""
+        SELECT sum(t.heap_blks_hit) AS table_hits,
+               sum(t.heap_blks_read) AS table_reads,
+               sum(t.idx_blks_hit) AS index_hits,
+               sum(t.idx_blks_read) AS index_reads
+        FROM pg_statio_user_tables t
+        WHERE t.schemaname = current_schema()
+    """)).one()
+
+    def ratio(hits, reads):
+        total = (hits or 0) + (reads or 0)
+        return float(hits) / float(total) if total else None
+
+    return {
+        'tables': ratio(row.table_hits, row.table_reads),
+        'indexes': ratio(row.index_hits, row.index_reads)
+    }
+
+def get_slow_statements(limit=SLOW_STATEMENT_LIMIT):
+    """
+    Statements with the highest total execution time from
+    pg_stat_statements, or None when the extension isn't installed or
+    readable. Postgres 13 renamed total_time and mean_time to
+    total_exec_time and mean_exec_time; both are handled.
+    """
+    installed = db.session.execute(text(
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'"
+    )).first()
+    if installed is None:
+        return None
+
+    columns = set(db.session.execute(text(
+        "SELECT attname FROM pg_attribute WHERE attrelid = 'pg_stat_statements'::regclass AND attnum > 0"
+    )).scalars())
+    suffix = '_exec_time' if 'total_exec_time' in columns else '_time'
+
+    try:
+        with db.session.begin_nested():
+            rows = db.session.execute(text(f"""
+                SELECT query, calls,
+                       total{suffix} AS total_ms,
+                       mean{suffix} AS mean_ms,
+                       rows
+                FROM pg_stat_statements
+                WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+                ORDER BY total{suffix} DESC
+                LIMIT :limit
+            """), {'limit': limit}).mappings().all()
+        return [dict(row) for row in rows]
+    except Exception:
+        # Installed but not loaded through shared_preload_libraries
+        return None
+
+def get_exact_count(table_name):
+    """COUNT(*) of one user table; raises ValueError for names that aren't user tables"""
+    exists = db.session.execute(text(
+        "SELECT 1 FROM pg_stat_user_tables WHERE schemaname = current_schema() AND relname = :table_name"
+    ), {'table_name': table_name}).first()
+    if exists is None:
+        raise ValueError(f'Unknown table {table_name}')
+    return db.session.execute(text(f'SELECT count(*) FROM "{table_name}"')).scalar()
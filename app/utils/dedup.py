@@ -0,0 +1,214 @@
+import re
+import unicodedata
+from collections import defaultdict
+from difflib import SequenceMatcher
+from sqlalchemy import func, or_
+from app import db
+from app.models import Customer, SaleTransaction
+from app.utils.exports import stream_rows
+
+# Blocks bigger than this (a shared shop phone, a very common surname) say
+# little about identity and would make comparisons quadratic, so they are skipped
+MAX_BLOCK_SIZE = 50
+
+# Phones are compared on their last digits so country and trunk prefixes
+# don't matter; ix_customers_phone_suffix indexes the same suffix
+PHONE_KEY_DIGITS = 9
+
+# A shared phone or email plus a 60% similar name, or an identical name with
+# no conflicting phone or email
+DEFAULT_MIN_SCORE = 0.6
+
+SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'), **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'), 'l': '4', **dict.fromkeys('mn', '5'), 'r': '6'
+}
+
+def soundex(word):
+    """American Soundex code of a lowercase ASCII word, e.g. smith and smyth -> s530"""
+    if not word:
+        return ''
+    code = word[0]
+    previous = SOUNDEX_CODES.get(word[0], '')
+    for char in word[1:]:
+        digit = SOUNDEX_CODES.get(char, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # h and w don't separate letters with the same code; vowels do
+        if char not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+def normalize_name(name):
+    """Lowercase ASCII words of a name, in sorted order so word order doesn't matter"""
+    name = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode().lower()
+    return ' '.join(sorted(re.findall(r'[a-z]+', name)))
+
+def blocking_keys(customer):
+    """Keys under which a prepared customer is filed; only customers sharing a key are compared"""
+    keys = []
+    if customer['phone']:
+        keys.append(('phone', customer['phone']))
+    if customer['email']:
+        keys.append(('email', customer['email']))
+    if customer['name']:
+        keys.append(('name', ' '.join(soundex(word) for word in customer['name'].split())))
+    return keys
+
+def score_pair(a, b, min_score=0):
+    """
+    Match score in [0, 1] for two prepared customers: name similarity (0.5,
+    or 0.6 for identical names), plus agreement on phone and email, minus
+    conflicting phones or emails. Returns the score and the reasons behind
+    it. Pairs that cannot reach min_score score 0 without the name
+    comparison being run.
+    """
+    score = 0
+    reasons = []
+    if a['phone'] and b['phone']:
+        if a['phone'] == b['phone']:
+            score += 0.3
+            reasons.append('same phone')
+        else:
+            score -= 0.15
+            reasons.append('different phone')
+    if a['email'] and b['email']:
+        if a['email'] == b['email']:
+            score += 0.2
+            reasons.append('same email')
+        else:
+            score -= 0.15
+            reasons.append('different email')
+
+    if not (a['name'] and b['name']) or score + 0.6 < min_score:
+        return max(score, 0), reasons
+
+    # Customers entered twice without contact details match on the name alone
+    if a['name'] == b['name']:
+        return max(score + 0.6, 0), ['same name'] + reasons
+
+    matcher = SequenceMatcher(None, a['name'], b['name'])
+    # quick_ratio is a cheap upper bound of ratio
+    if score + 0.5 * matcher.quick_ratio() < min_score:
+        return 0, reasons
+
+    name_similarity = matcher.ratio()
+    return max(score + 0.5 * name_similarity, 0), [f'name {name_similarity:.0%} similar'] + reasons
+
+def prepare_customer(row):
+    return {
+        'id': row.id,
+        'name': normalize_name(row.name),
+        'phone': row.phone_digits[-PHONE_KEY_DIGITS:] if row.phone_digits and len(row.phone_digits) >= 7 else None,
+        'email': row.email.strip().lower() if row.email and row.email.strip() else None
+    }
+
+def find_duplicate_groups(min_score=DEFAULT_MIN_SCORE, limit=None):
+    """
+    Groups of customers that are probably the same person.
+
+    Customers are read once as plain tuples and filed under their blocking
+    keys; pairs are only scored within a block, so the work grows with the
+    size of the blocks rather than the square of the table. Pairs at or above
+    min_score are joined into groups, strongest first. Each group has its
+    customer ids, best pair score and the reasons for the best match.
+    """
+    query = db.session.query(Customer.id, Customer.name, Customer.phone_digits, Customer.email).order_by(Customer.id)
+
+    customers = {}
+    blocks = defaultdict(list)
+    for row in stream_rows(query):
+        customer = prepare_customer(row)
+        customers[row.id] = customer
+        for key in blocking_keys(customer):
+            blocks[key].append(row.id)
+
+    pair_scores = {}
+    for ids in blocks.values():
+        if len(ids) < 2 or len(ids) > MAX_BLOCK_SIZE:
+            continue
+        for i, first in enumerate(ids):
+            for second in ids[i + 1:]:
+                if (first, second) not in pair_scores:
+                    pair_scores[(first, second)] = score_pair(customers[first], customers[second], min_score)
+
+    # Union-find over matching pairs
+    parent = {}
+    def find(customer_id):
+        parent.setdefault(customer_id, customer_id)
+        while parent[customer_id] != customer_id:
+            parent[customer_id] = parent[parent[customer_id]]
+            customer_id = parent[customer_id]
+        return customer_id
+
+    best = {}
+    for (first, second), (score, reasons) in pair_scores.items():
+        if score < min_score:
+            continue
+        parent[find(second)] = find(first)
+        best[(first, second)] = (score, reasons)
+
+    groups = defaultdict(lambda: {'customer_ids': set(), 'score': 0, 'reasons': []})
+    for (first, second), (score, reasons) in best.items():
+        group = groups[find(first)]
+        group['customer_ids'].update((first, second))
+        if score > group['score']:
+            group['score'], group['reasons'] = score, reasons
+
+    results = sorted(
+        ({'customer_ids': sorted(group['customer_ids']), 'score': round(group['score'], 3), 'reasons': group['reasons']}
+         for group in groups.values()),
+        key=lambda group: (-group['score'], group['customer_ids'][0])
+    )
+    return results[:limit] if limit else results
+
+def find_possible_duplicates(customer, limit=5):
+    """Existing customers sharing a phone number or email with customer, by index lookups"""
+    conditions = []
+    digits = re.sub(r'\D', '', customer.phone or '')
+    if len(digits) >= 7:
+        conditions.append(func.right(Customer.phone_digits, PHONE_KEY_DIGITS) == digits[-PHONE_KEY_DIGITS:])
+    if customer.email and customer.email.strip():
+        conditions.append(func.lower(Customer.email) == customer.email.strip().lower())
+    if not conditions:
+        return []
+
+    return Customer.query.filter(or_(*conditions), Customer.id != customer.id).order_by(Customer.id).limit(limit).all()
+
+def merge_customers(target_id, duplicate_ids):
+    """
+    Merge duplicates into the target customer: their sales are moved over
+    with one bulk UPDATE, missing contact details are filled in from them,
+    and they are deleted, all in one transaction. Returns the number of
+    sales moved.
+    """
+    duplicate_ids = [customer_id for customer_id in set(duplicate_ids) if customer_id != target_id]
+    target = db.session.get(Customer, target_id)
+    if target is None:
+        raise ValueError('Customer to keep was not found.')
+    if not duplicate_ids:
+        raise ValueError('Select at least one other customer to merge.')
+
+    duplicates = Customer.query.filter(Customer.id.in_(duplicate_ids)).order_by(Customer.created_at).all()
+    if len(duplicates) != len(duplicate_ids):
+        raise ValueError('Some of the selected customers no longer exist.')
+
+    try:
+        moved = db.session.query(SaleTransaction).filter(
+            SaleTransaction.customer_id.in_(duplicate_ids)
+        ).update({SaleTransaction.customer_id: target_id}, synchronize_session=False)
+
+        for duplicate in duplicates:
+            target.phone = target.phone or duplicate.phone
+            target.email = target.email or duplicate.email
+            target.address = target.address or duplicate.address
+
+        # Deleted in SQL so the ORM doesn't try to null out the sales it still has cached
+        db.session.query(Customer).filter(Customer.id.in_(duplicate_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        return moved
+    except Exception:
+        db.session.rollback()
+        raise
@@ -0,0 +1,76 @@
+import csv
+import tempfile
+from io import StringIO
+from datetime import datetime
+from flask import Response, stream_with_context
+from openpyxl import Workbook
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_CHUNK_SIZE = 1000
+
+# Bytes per chunk when streaming a finished workbook to the client
+FILE_CHUNK_SIZE = 64 * 1024
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def stream_rows(query, chunk_size=EXPORT_CHUNK_SIZE):
+    """Iterate over a query through a server-side cursor, chunk_size rows at a time"""
+    return query.yield_per(chunk_size)
+
+def generate_csv(headers, rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield CSV text in chunks of chunk_size rows"""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue()
+
+def generate_xlsx(sheet_name, headers, rows):
+    """
+    Write rows to a write-only workbook and yield the finished file in chunks.
+    Write-only worksheets flush each row to disk, so memory stays flat.
+    """
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title=sheet_name)
+    worksheet.append(headers)
+    for row in rows:
+        worksheet.append(list(row))
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        yield from iter_file_chunks(output)
+
+def iter_file_chunks(fileobj, chunk_size=FILE_CHUNK_SIZE):
+    """Yield the rest of an open binary file in chunks of chunk_size bytes"""
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+def export_response(filename_prefix, sheet_name, headers, rows, export_format='xlsx'):
+    """Build a streamed download response for an export in xlsx or csv format"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    if export_format == 'csv':
+        body = generate_csv(headers, rows)
+        mimetype = 'text/csv'
+        filename = f'{filename_prefix}_{timestamp}.csv'
+    else:
+        body = generate_xlsx(sheet_name, headers, rows)
+        mimetype = XLSX_MIMETYPE
+        filename = f'{filename_prefix}_{timestamp}.xlsx'
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
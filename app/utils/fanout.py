@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app import db
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_fan_out_workers():
+    """
+    FANOUT_MAX_WORKERS, kept below the connection pool size so request
+    threads always have pooled connections left
+    """
+    workers = current_app.config.get('FANOUT_MAX_WORKERS', 4)
+    pool_size = getattr(db.engine.pool, 'size', None)
+    if callable(pool_size):
+        workers = min(workers, pool_size() - 1)
+    return workers
+
+def get_executor():
+    """Thread pool shared by every request in this process, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_fan_out_workers(), thread_name_prefix='fan-out')
+        return _executor
+
+def fan_out(**tasks):
+    """
+    Run independent read-only callables concurrently and return their results
+    by name, e.g. fan_out(revenue=get_revenue, count=get_count)['revenue'].
+    Only worth it for slow, uncached queries; cached lookups are faster
+    called directly.
+
+    Each task runs in its own app context, so db.session there is a separate
+    session on its own pooled connection, closed when the task finishes.
+    Tasks must build their queries themselves: a query created by the caller
+    is bound to the caller's session. Objects a task returns are detached:
+    loaded attributes are readable but relationships must be loaded by the
+    task. The tasks of every request in the process share one pool of
+    get_fan_out_workers() threads, so however many pages load at once they
+    hold at most that many extra connections; with a single worker, or when
+    called from a task, the tasks run one after another in the caller's
+    context. The first exception raised by a task is re-raised here.
+    """
+    nested = threading.current_thread().name.startswith('fan-out')
+    if len(tasks) <= 1 or nested or get_fan_out_workers() <= 1:
+        return {name: task() for name, task in tasks.items()}
+
+    app = current_app._get_current_object()
+    def run(task):
+        with app.app_context():
+            return task()
+
+    executor = get_executor()
+    futures = {name: executor.submit(run, task) for name, task in tasks.items()}
+    return {name: future.result() for name, future in futures.items()}
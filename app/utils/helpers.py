@@ -1,8 +1,10 @@
+import re
 from datetime import datetime, timedelta
 from sqlalchemy import func, and_, or_
 from sqlalchemy.orm import joinedload
 from app import db
 from app.models import User, Medication, SaleTransaction, SaleItem, Customer
+from app.utils.exports import stream_rows
 
 def create_admin_user():
     """Create admin user if it doesn't exist"""
@@ -147,12 +149,15 @@ def get_medications_with_stock():
     ).order_by(Medication.name).all()
     return medications
 
-def get_all_sales():
-    sales = SaleTransaction.query.options(
+def get_all_sales_query():
+    return SaleTransaction.query.options(
         joinedload(SaleTransaction.customer),
         joinedload(SaleTransaction.user)
-    ).order_by(SaleTransaction.sale_date.desc()).all()
-    return sales
+    ).order_by(SaleTransaction.sale_date.desc())
+
+def get_all_sales():
+    """Iterate over every sale through a server-side cursor"""
+    return stream_rows(get_all_sales_query())
 
 def get_filtered_sales(filter_type):
     query = SaleTransaction.query.options(
@@ -383,9 +388,12 @@ def get_expiring_soon_medications(days=30):
 def get_medication_by_id(medication_id):
     return Medication.query.get(medication_id)
 
+def get_all_medications_query():
+    return Medication.query.filter_by(deleted=False).order_by(Medication.name)
+
 def get_all_medications():
-    medications = Medication.query.filter_by(deleted=False).order_by(Medication.name).all()
-    return medications
+    """Iterate over active medications through a server-side cursor"""
+    return stream_rows(get_all_medications_query())
 
 def get_medications_with_stock():
     from sqlalchemy import and_
@@ -466,8 +474,11 @@ def process_sale_transaction(items, customer_id, user_id, payment_method, discou
             )
             db.session.add(sale_item)
             
-            # Update medication stock
+            # Update medication stock and sales velocity
             medication.stock_quantity -= item['quantity']
+            medication.last_sold_at = datetime.now()
+            medication.units_sold_30d = (medication.units_sold_30d or 0) + item['quantity']
+            medication.units_sold_90d = (medication.units_sold_90d or 0) + item['quantity']
         
         db.session.commit()
         return sale
@@ -484,28 +495,160 @@ def get_sale_details(sale_id):
         joinedload(SaleTransaction.user)
     ).get(sale_id)
 
+def get_sales_period_condition(filter_type, start_date=None, end_date=None):
+    """
+    Build the sale_date condition for a transactions filter as a plain
+    range, so it can use the sale_date index. Returns None for 'all'.
+    """
+    now = datetime.now()
+    today_start = datetime.combine(now.date(), datetime.min.time())
+    
+    if filter_type == 'today':
+        return SaleTransaction.sale_date >= today_start
+    elif filter_type == 'week':
+        return SaleTransaction.sale_date >= now - timedelta(days=7)
+    elif filter_type == 'month':
+        return SaleTransaction.sale_date >= today_start.replace(day=1)
+    elif filter_type == 'range' and start_date and end_date:
+        return and_(
+            SaleTransaction.sale_date >= start_date,
+            SaleTransaction.sale_date < end_date + timedelta(days=1)
+        )
+    return None
+
 def get_filtered_sales(filter_type):
     from sqlalchemy.orm import joinedload
-    from sqlalchemy import func
     
     query = SaleTransaction.query.options(
         joinedload(SaleTransaction.customer),
         joinedload(SaleTransaction.user)
     ).filter(SaleTransaction.payment_status == 'completed')
     
-    if filter_type == 'today':
-        today = datetime.now().date()
-        query = query.filter(func.date(SaleTransaction.sale_date) == today)
-    elif filter_type == 'week':
-        week_ago = datetime.now() - timedelta(days=7)
-        query = query.filter(SaleTransaction.sale_date >= week_ago)
-    elif filter_type == 'month':
-        current_month = datetime.now().strftime('%Y-%m')
-        query = query.filter(func.to_char(SaleTransaction.sale_date, 'YYYY-MM') == current_month)
+    condition = get_sales_period_condition(filter_type)
+    if condition is not None:
+        query = query.filter(condition)
     
     sales = query.order_by(SaleTransaction.sale_date.desc()).all()
     return sales
 
+def get_sales_page(filter_type, page=1, per_page=25, start_date=None, end_date=None):
+    """
+    One page of completed sales, newest first. Customer and cashier are
+    joined in; line items and their medications are batch-loaded for the
+    page only. The caller sets pagination.total from get_sales_totals().
+    """
+    from sqlalchemy.orm import joinedload, selectinload
+    
+    query = SaleTransaction.query.options(
+        joinedload(SaleTransaction.customer),
+        joinedload(SaleTransaction.user),
+        selectinload(SaleTransaction.items).joinedload(SaleItem.medication)
+    ).filter(SaleTransaction.payment_status == 'completed')
+    
+    condition = get_sales_period_condition(filter_type, start_date, end_date)
+    if condition is not None:
+        query = query.filter(condition)
+    
+    return query.order_by(
+        SaleTransaction.sale_date.desc(),
+        SaleTransaction.id.desc()
+    ).paginate(page=page, per_page=per_page, error_out=False, count=False)
+
+def get_sales_totals(filter_type, start_date=None, end_date=None):
+    """Count, revenue, average and today's revenue for a filter in one aggregate query"""
+    condition = get_sales_period_condition(filter_type, start_date, end_date)
+    today_condition = get_sales_period_condition('today')
+    in_period = condition if condition is not None else True
+    
+    query = db.session.query(
+        func.count(SaleTransaction.id).filter(in_period).label('count'),
+        func.coalesce(func.sum(SaleTransaction.total_amount).filter(in_period), 0).label('revenue'),
+        func.coalesce(func.sum(SaleTransaction.total_amount).filter(today_condition), 0).label('today_revenue')
+    ).filter(SaleTransaction.payment_status == 'completed')
+    if condition is not None:
+        query = query.filter(or_(condition, today_condition))
+    
+    totals = query.one()
+    return {
+        'count': totals.count,
+        'revenue': float(totals.revenue),
+        'average': float(totals.revenue) / totals.count if totals.count else 0,
+        'today_revenue': float(totals.today_revenue)
+    }
+
+def get_customer_stats(customer_id):
+    """Purchase count, total, average and first/last purchase for a customer in one aggregate query"""
+    stats = db.session.query(
+        func.count(SaleTransaction.id).label('count'),
+        func.coalesce(func.sum(SaleTransaction.total_amount), 0).label('total'),
+        func.min(SaleTransaction.sale_date).label('first_purchase'),
+        func.max(SaleTransaction.sale_date).label('last_purchase')
+    ).filter(SaleTransaction.customer_id == customer_id).one()
+    return {
+        'count': stats.count,
+        'total': float(stats.total),
+        'average': float(stats.total) / stats.count if stats.count else 0,
+        'first_purchase': stats.first_purchase,
+        'last_purchase': stats.last_purchase
+    }
+
+def get_customer_sales_page(customer_id, before=None, after=None, per_page=25):
+    """
+    One page of a customer's purchases, newest first, by keyset pagination
+    on (sale_date, id): before pages to older sales, after to newer ones.
+    Cursors come from the returned older_cursor/newer_cursor, and line
+    items are batch-loaded for the page only.
+    """
+    from sqlalchemy import tuple_
+    from sqlalchemy.orm import joinedload, selectinload
+    
+    key = tuple_(SaleTransaction.sale_date, SaleTransaction.id)
+    query = SaleTransaction.query.options(
+        joinedload(SaleTransaction.user),
+        selectinload(SaleTransaction.items)
+    ).filter(SaleTransaction.customer_id == customer_id)
+    
+    cursor = parse_sale_cursor(after)
+    if cursor:
+        # Walk forward from the cursor, then flip back to newest first
+        sales = query.filter(key > cursor).order_by(
+            SaleTransaction.sale_date, SaleTransaction.id
+        ).limit(per_page + 1).all()
+        if len(sales) <= per_page:
+            # Nothing newer than this page: show the newest full page instead
+            return get_customer_sales_page(customer_id, per_page=per_page)
+        sales = sales[:per_page][::-1]
+        has_newer = has_older = True
+    else:
+        cursor = parse_sale_cursor(before)
+        if cursor:
+            query = query.filter(key < cursor)
+        sales = query.order_by(
+            SaleTransaction.sale_date.desc(), SaleTransaction.id.desc()
+        ).limit(per_page + 1).all()
+        has_older = len(sales) > per_page
+        sales = sales[:per_page]
+        has_newer = cursor is not None
+    
+    return {
+        'sales': sales,
+        'older_cursor': format_sale_cursor(sales[-1]) if sales and has_older else None,
+        'newer_cursor': format_sale_cursor(sales[0]) if sales and has_newer else None
+    }
+
+def format_sale_cursor(sale):
+    return f'{sale.sale_date.isoformat()}_{sale.id}'
+
+def parse_sale_cursor(cursor):
+    """(sale_date, id) from a cursor, or None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        sale_date, sale_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(sale_date), int(sale_id)
+    except ValueError:
+        return None
+
 def get_sales_report(start_date=None, end_date=None):
     from sqlalchemy.orm import joinedload
     query = SaleTransaction.query.options(
@@ -559,16 +702,57 @@ def get_daily_sales_chart_data(days=30):
     
 
 
-def search_customers(search_term):
-    from sqlalchemy import or_
-    search_pattern = f'%{search_term}%'
-    return Customer.query.filter(
-        or_(
-            Customer.name.ilike(search_pattern),
-            Customer.phone.ilike(search_pattern),
-            Customer.email.ilike(search_pattern)
-        )
-    ).all()
+def search_customers(search_term, limit=20):
+    """
+    Ranked customer lookup for checkout, at most limit results.
+    Phone numbers are matched on their digits: exact match first, then
+    numbers starting with them, then numbers containing them (such as the
+    last digits). Emails are matched exactly, and names by prefix before
+    substring. Exact and prefix matches are btree index scans; substring
+    matches use the pg_trgm indexes from ensure_trigram_indexes when the
+    extension is available, and scan the table otherwise.
+    """
+    search_term = (search_term or '').strip()
+    if not search_term:
+        return []
+    
+    digits = re.sub(r'\D', '', search_term)
+    if digits and not re.search(r'[A-Za-z@]', search_term):
+        exact = Customer.query.filter(Customer.phone_digits == digits).order_by(Customer.name).limit(limit).all()
+        if exact:
+            return exact
+        prefix_match = Customer.phone_digits.startswith(digits, autoescape=True)
+        results = Customer.query.filter(prefix_match).order_by(
+            Customer.phone_digits, Customer.name
+        ).limit(limit).all()
+        
+        # Trigrams need three characters to narrow anything down
+        if len(results) < limit and len(digits) >= 3:
+            results += Customer.query.filter(
+                Customer.phone_digits.contains(digits, autoescape=True),
+                ~prefix_match
+            ).order_by(Customer.phone_digits, Customer.name).limit(limit - len(results)).all()
+        return results
+    
+    if '@' in search_term:
+        return Customer.query.filter(
+            func.lower(Customer.email) == search_term.lower()
+        ).order_by(Customer.name).limit(limit).all()
+    
+    name = func.lower(Customer.name)
+    term = search_term.lower()
+    prefix_match = name.startswith(term, autoescape=True)
+    results = Customer.query.filter(prefix_match).order_by(
+        (name == term).desc(), Customer.name
+    ).limit(limit).all()
+    
+    # Fill up with names containing the term elsewhere
+    if len(results) < limit:
+        results += Customer.query.filter(
+            name.contains(term, autoescape=True),
+            ~prefix_match
+        ).order_by(Customer.name).limit(limit - len(results)).all()
+    return results
 
 def get_customer_by_id(customer_id):
     return Customer.query.get(customer_id)
@@ -581,8 +765,7 @@ def create_customer(name, phone=None, email=None, address=None):
     
 
 
-def get_sales_report(start_date=None, end_date=None):
-    from sqlalchemy.orm import joinedload
+def get_sales_report_query(start_date=None, end_date=None):
     query = SaleTransaction.query.options(
         joinedload(SaleTransaction.customer),
         joinedload(SaleTransaction.user)
@@ -595,98 +778,121 @@ def get_sales_report(start_date=None, end_date=None):
     elif end_date:
         query = query.filter(SaleTransaction.sale_date <= end_date)
     
-    return query.order_by(SaleTransaction.sale_date.desc()).all()
+    return query.order_by(SaleTransaction.sale_date.desc())
+
+def get_sales_report(start_date=None, end_date=None):
+    """
+    Iterate over completed sales through a server-side cursor. Without
+    dates this is the whole sales history, so it is never loaded at once.
+    """
+    return stream_rows(get_sales_report_query(start_date, end_date))
 
 def get_daily_sales_chart_data(days=30):
-    from sqlalchemy import func
+    """Gap-filled daily completed sales for the last days days, including today"""
+    from app.utils.analytics import get_sales_timeseries
     end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=days)
-    
-    # Get daily sales data
-    daily_sales = db.session.query(
-        func.date(SaleTransaction.sale_date).label('sale_date'),
-        func.sum(SaleTransaction.total_amount).label('total_sales'),
-        func.count(SaleTransaction.id).label('transaction_count')
-    ).filter(
-        SaleTransaction.sale_date.between(start_date, end_date),
-        SaleTransaction.payment_status == 'completed'
-    ).group_by(
-        func.date(SaleTransaction.sale_date)
-    ).order_by(
-        func.date(SaleTransaction.sale_date)
-    ).all()
-    
-    # Format data for chart
-    dates = []
-    sales = []
-    transactions = []
-    
-    for day in daily_sales:
-        dates.append(day.sale_date.strftime('%Y-%m-%d'))
-        sales.append(float(day.total_sales) if day.total_sales else 0)
-        transactions.append(day.transaction_count)
+    series = get_sales_timeseries(end_date - timedelta(days=days), end_date, bucket='day', max_points=days + 1)
     
     return {
-        'dates': dates,
-        'sales': sales,
-        'transactions': transactions
+        'dates': series['labels'],
+        'sales': series['sales'],
+        'transactions': series['transactions']
     }
 
 def get_sales_summary():
-    from sqlalchemy import func, and_
-    # Total medications (exclude deleted)
-    total_medications = Medication.query.filter_by(deleted=False).count()
-    
-    # Low stock count (exclude deleted)
-    low_stock_count = Medication.query.filter(
-        and_(
-            Medication.stock_quantity <= 10,
-            Medication.deleted == False
-        )
-    ).count()
-    
-    # Expired medications count (exclude deleted)
-    expired_count = Medication.query.filter(
-        and_(
-            Medication.expiry_date.isnot(None),
-            Medication.expiry_date < datetime.now().date(),
-            Medication.deleted == False
-        )
-    ).count()
-    
-    # Today's sales
-    today = datetime.now().date()
-    today_sales = db.session.query(
-        func.coalesce(func.sum(SaleTransaction.total_amount), 0)
-    ).filter(
-        func.date(SaleTransaction.sale_date) == today,
-        SaleTransaction.payment_status == 'completed'
-    ).scalar()
-    
-    # Month sales
-    current_month = datetime.now().strftime('%Y-%m')
-    month_sales = db.session.query(
-        func.coalesce(func.sum(SaleTransaction.total_amount), 0)
+    """
+    All dashboard counters from a single statement: one CTE per table,
+    each scanning it once with FILTER clauses, cross-joined into one row.
+    """
+    from sqlalchemy import true
+    
+    now = datetime.now()
+    today = now.date()
+    today_start = datetime.combine(today, datetime.min.time())
+    month_start = today_start.replace(day=1)
+    one_day_ago = now - timedelta(days=1)
+    
+    medication_stats = db.session.query(
+        func.count(Medication.id).label('total_medications'),
+        func.count(Medication.id).filter(Medication.stock_quantity <= 10).label('low_stock_count'),
+        func.count(Medication.id).filter(
+            Medication.expiry_date < today
+        ).label('expired_count'),
+        func.count(Medication.id).filter(
+            Medication.expiry_date >= today,
+            Medication.expiry_date <= today + timedelta(days=30)
+        ).label('expiring_soon_count'),
+        func.count(Medication.id).filter(
+            Medication.created_at >= now - timedelta(days=7)
+        ).label('recent_medications_count')
+    ).filter(Medication.deleted == False).cte('medication_stats')
+    
+    completed = SaleTransaction.payment_status == 'completed'
+    sale_stats = db.session.query(
+        func.coalesce(func.sum(SaleTransaction.total_amount).filter(
+            completed, SaleTransaction.sale_date >= today_start
+        ), 0).label('today_sales'),
+        func.coalesce(func.sum(SaleTransaction.total_amount).filter(
+            completed, SaleTransaction.sale_date >= month_start
+        ), 0).label('month_sales'),
+        func.count(SaleTransaction.id).filter(
+            SaleTransaction.sale_date >= one_day_ago
+        ).label('recent_sales_count')
     ).filter(
-        func.to_char(SaleTransaction.sale_date, 'YYYY-MM') == current_month,
-        SaleTransaction.payment_status == 'completed'
-    ).scalar()
+        SaleTransaction.sale_date >= min(month_start, one_day_ago)
+    ).cte('sale_stats')
     
-    # Today's profit
-    today_profit = db.session.query(
-        func.coalesce(func.sum(SaleItem.quantity * (SaleItem.unit_price - Medication.cost_price)), 0)
+    profit_stats = db.session.query(
+        func.coalesce(func.sum(SaleItem.quantity * (SaleItem.unit_price - Medication.cost_price)), 0).label('today_profit')
+    ).select_from(SaleItem
     ).join(Medication, SaleItem.medication_id == Medication.id
     ).join(SaleTransaction, SaleItem.sale_id == SaleTransaction.id
     ).filter(
-        func.date(SaleTransaction.sale_date) == today,
-        SaleTransaction.payment_status == 'completed'
-    ).scalar()
+        completed,
+        SaleTransaction.sale_date >= today_start
+    ).cte('profit_stats')
+    
+    user_stats = db.session.query(
+        func.count(User.id).label('total_users_count'),
+        func.count(User.id).filter(User.role == 'admin').label('admin_count')
+    ).cte('user_stats')
+    
+    summary = db.session.query(
+        medication_stats, sale_stats, profit_stats, user_stats
+    ).select_from(medication_stats
+    ).join(sale_stats, true()
+    ).join(profit_stats, true()
+    ).join(user_stats, true()
+    ).one()
     
     return {
-        'total_medications': total_medications,
-        'low_stock_count': low_stock_count,
-        'expired_count': expired_count,
-        'today_sales': float(today_sales),
-        'month_sales': float(month_sales),
-        'today_profit': float(today_profit) if today_profit else 0
-    }
\ No newline at end of file
+        'total_medications': summary.total_medications,
+        'low_stock_count': summary.low_stock_count,
+        'expired_count': summary.expired_count,
+        'expiring_soon_count': summary.expiring_soon_count,
+        'recent_medications_count': summary.recent_medications_count,
+        'today_sales': float(summary.today_sales),
+        'month_sales': float(summary.month_sales),
+        'recent_sales_count': summary.recent_sales_count,
+        'today_profit': float(summary.today_profit),
+        'total_users_count': summary.total_users_count,
+        'admin_count': summary.admin_count
+    }
+
+def get_cached_sales_summary():
+    """
+    Dashboard summary shared by every request in this worker for
+    SUMMARY_CACHE_TTL seconds. Concurrent pollers wait on one computation.
+    """
+    from flask import current_app
+    from app.utils.cache import cache
+    
+    ttl = current_app.config.get('SUMMARY_CACHE_TTL', 5)
+    return cache.get_or_compute('sales_summary', get_sales_summary, ttl)
+
+def get_cached_daily_sales_chart_data(days=30):
+    from flask import current_app
+    from app.utils.cache import cache
+    
+    ttl = current_app.config.get('CHART_CACHE_TTL', 60)
+    return cache.get_or_compute(f'daily_sales_chart:{days}', lambda: get_daily_sales_chart_data(days), ttl)
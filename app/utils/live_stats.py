@@ -0,0 +1,206 @@
+import json
+import queue
+import select
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Dashboard figures pushed to subscribers when they change
+LIVE_STAT_KEYS = (
+    'total_medications',
+    'low_stock_count',
+    'expired_count',
+    'expiring_soon_count',
+    'today_sales',
+    'month_sales',
+    'recent_sales_count'
+)
+
+# Seconds between comment lines that keep idle connections open through proxies
+KEEPALIVE_SECONDS = 25
+
+# Channel the triggers installed by ensure_schema notify on commit
+LIVE_STATS_CHANNEL = 'live_stats'
+
+# Seconds before a lost LISTEN connection is opened again
+LISTEN_RETRY_SECONDS = 5
+
+class LiveStatsPublisher:
+    """
+    One publisher per worker process. Commits that touch sales or inventory
+    wake a single background thread, which recomputes the dashboard summary
+    once and fans the changed figures out to every open stream.
+
+    Commits in this process are seen through the session hooks. Commits in
+    other workers, bulk UPDATEs and changes made outside the app arrive as
+    Postgres NOTIFYs on LIVE_STATS_CHANNEL, received by a listener thread
+    while anyone is subscribed. The summary is also recomputed every
+    LIVE_STATS_REFRESH_SECONDS, which covers figures that change with the
+    clock alone, such as today's sales at midnight and expiry counts.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._changed = threading.Event()
+        self._thread = None
+        self._listener = None
+        self._last = {}
+
+    def init_app(self, app):
+        self.app = app
+        event.listen(Session, 'after_flush', self._track_changes)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_soft_rollback', self._after_rollback)
+
+    def _track_changes(self, session, flush_context):
+        from app.models import SaleTransaction, SaleItem, Medication
+        tracked = (SaleTransaction, SaleItem, Medication)
+        for instance in (*session.new, *session.dirty, *session.deleted):
+            if isinstance(instance, tracked):
+                session.info['live_stats_changed'] = True
+                return
+
+    def _after_commit(self, session):
+        if session.info.pop('live_stats_changed', False):
+            self.notify()
+
+    def _after_rollback(self, session, previous_transaction):
+        session.info.pop('live_stats_changed', None)
+
+    def notify(self):
+        """Mark the summary stale and wake the publisher if anyone is listening"""
+        from app.utils.cache import cache
+        cache.invalidate('sales_summary')
+        if self._subscribers:
+            self._changed.set()
+
+    def subscribe(self, snapshot):
+        subscriber = queue.Queue(maxsize=16)
+        with self._lock:
+            if not self._subscribers:
+                self._last = {key: snapshot[key] for key in LIVE_STAT_KEYS}
+            self._subscribers.add(subscriber)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='live-stats-publisher', daemon=True)
+                self._thread.start()
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='live-stats-listener', daemon=True)
+                self._listener.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _run(self):
+        from app.utils.helpers import get_cached_sales_summary
+        refresh_seconds = self.app.config.get('LIVE_STATS_REFRESH_SECONDS', 60)
+        while True:
+            self._changed.wait(refresh_seconds)
+            self._changed.clear()
+            if not self._subscribers:
+                continue
+
+            try:
+                with self.app.app_context():
+                    summary = get_cached_sales_summary()
+            except Exception as e:
+                self.app.logger.warning(f'Live stats refresh failed: {str(e)}')
+                continue
+
+            delta = {
+                key: summary[key] for key in LIVE_STAT_KEYS
+                if summary[key] != self._last.get(key)
+            }
+            if not delta:
+                continue
+            self._last.update(delta)
+
+            message = format_event('stats', delta)
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # A stalled client gets a fresh snapshot when it reconnects
+                    self.unsubscribe(subscriber)
+
+    def _listen(self):
+        """
+        LISTEN on a dedicated connection, outside the pool, until the last
+        subscriber leaves. Only psycopg2 exposes notifications this way;
+        elsewhere the periodic refresh is all there is.
+        """
+        from app import db
+        with self.app.app_context():
+            engine = db.engine
+        if engine.dialect.driver != 'psycopg2':
+            return
+
+        listener = None
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._listener = None
+                    break
+
+            try:
+                if listener is None:
+                    connection = engine.raw_connection()
+                    listener = connection.driver_connection
+                    connection.detach()
+                    listener.autocommit = True
+                    with listener.cursor() as cursor:
+                        cursor.execute(f'LISTEN {LIVE_STATS_CHANNEL}')
+
+                if select.select([listener], [], [], KEEPALIVE_SECONDS)[0]:
+                    listener.poll()
+                    if listener.notifies:
+                        listener.notifies.clear()
+                        self.notify()
+            except Exception as e:
+                self.app.logger.warning(f'Live stats listener failed: {str(e)}')
+                if listener is not None:
+                    listener.close()
+                    listener = None
+                time.sleep(LISTEN_RETRY_SECONDS)
+
+        if listener is not None:
+            listener.close()
+
+    def stream(self, snapshot):
+        """
+        Server-sent event stream: the full snapshot first, then deltas.
+        A stream ends after LIVE_STATS_STREAM_SECONDS and the browser opens
+        a new one, so a worker isn't held by one dashboard for good. A
+        worker with LIVE_STATS_MAX_STREAMS streams open only sends the
+        snapshot and asks the browser to come back after the refresh
+        interval, which turns extra dashboards into slow pollers.
+        """
+        config = self.app.config
+        refresh_ms = config.get('LIVE_STATS_REFRESH_SECONDS', 60) * 1000
+        if len(self._subscribers) >= config.get('LIVE_STATS_MAX_STREAMS', 0):
+            yield f'retry: {refresh_ms}\n' + format_event('stats', {key: snapshot[key] for key in LIVE_STAT_KEYS})
+            return
+
+        deadline = time.monotonic() + config.get('LIVE_STATS_STREAM_SECONDS', 300)
+        subscriber = self.subscribe(snapshot)
+        try:
+            yield format_event('stats', {key: snapshot[key] for key in LIVE_STAT_KEYS})
+            # Dropped subscribers end the stream; the browser reconnects for a new snapshot
+            while subscriber in self._subscribers and time.monotonic() < deadline:
+                try:
+                    yield subscriber.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+        finally:
+            self.unsubscribe(subscriber)
+
+def format_event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+live_stats = LiveStatsPublisher()
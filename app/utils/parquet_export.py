@@ -0,0 +1,304 @@
+import os
+import json
+import shutil
+import zipfile
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func, text, and_, or_
+from app import db
+from app.models import SaleTransaction, SaleItem, Medication, Customer, RowTombstone
+from app.utils.exports import stream_rows
+
+# Rows per Arrow record batch (and per server-side cursor fetch)
+BATCH_SIZE = 10000
+
+MANIFEST_NAME = '_manifest.json'
+
+FACT_COLUMNS = [
+    ('sale_item_id', SaleItem.id),
+    ('sale_id', SaleTransaction.id),
+    ('transaction_id', SaleTransaction.transaction_id),
+    ('sale_date', SaleTransaction.sale_date),
+    ('payment_method', SaleTransaction.payment_method),
+    ('payment_status', SaleTransaction.payment_status),
+    ('user_id', SaleTransaction.user_id),
+    ('sale_total_amount', SaleTransaction.total_amount),
+    ('sale_tax_amount', SaleTransaction.tax_amount),
+    ('sale_discount_amount', SaleTransaction.discount_amount),
+    ('quantity', SaleItem.quantity),
+    ('unit_price', SaleItem.unit_price),
+    ('total_price', SaleItem.total_price),
+    ('medication_id', Medication.id),
+    ('medication_name', Medication.name),
+    ('generic_name', Medication.generic_name),
+    ('manufacturer', Medication.manufacturer),
+    ('category', Medication.category),
+    ('cost_price', Medication.cost_price),
+    ('customer_id', Customer.id),
+    ('customer_name', Customer.name),
+]
+
+def get_export_dir():
+    return current_app.config.get('PARQUET_EXPORT_DIR') or os.path.join(current_app.instance_path, 'sales_parquet')
+
+def _arrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError('Parquet export requires the pyarrow package.')
+    return pyarrow
+
+def get_fact_schema():
+    pa = _arrow()
+    money = pa.decimal128(10, 2)
+    types = {
+        'sale_item_id': pa.int64(),
+        'sale_id': pa.int64(),
+        'transaction_id': pa.string(),
+        'sale_date': pa.timestamp('us'),
+        'payment_method': pa.string(),
+        'payment_status': pa.string(),
+        'user_id': pa.int64(),
+        'sale_total_amount': money,
+        'sale_tax_amount': money,
+        'sale_discount_amount': money,
+        'quantity': pa.int32(),
+        'unit_price': money,
+        'total_price': money,
+        'medication_id': pa.int64(),
+        'medication_name': pa.string(),
+        'generic_name': pa.string(),
+        'manufacturer': pa.string(),
+        'category': pa.string(),
+        'cost_price': money,
+        'customer_id': pa.int64(),
+        'customer_name': pa.string(),
+    }
+    return pa.schema([(name, types[name]) for name, _ in FACT_COLUMNS])
+
+def sale_month_column():
+    return func.to_char(SaleTransaction.sale_date, 'YYYY-MM')
+
+def month_bounds(month):
+    """Start and exclusive end of a 'YYYY-MM' month, for range filters the sale_date index can serve"""
+    start = datetime.strptime(month, '%Y-%m')
+    if start.month == 12:
+        return start, start.replace(year=start.year + 1, month=1)
+    return start, start.replace(month=start.month + 1)
+
+def needs_full_export(since):
+    """
+    True if a sales table was truncated, or a full backup pruned the
+    tombstones, since the mark, so the changed rows can't be listed
+    """
+    return db.session.query(RowTombstone.id).filter(
+        RowTombstone.row_version >= since,
+        RowTombstone.row_id.is_(None),
+        RowTombstone.table_name.in_((SaleTransaction.__tablename__, SaleItem.__tablename__, RowTombstone.PRUNED))
+    ).first() is not None
+
+def get_tombstoned_ids(model, since):
+    return {row_id for row_id, in db.session.query(RowTombstone.row_id).filter(
+        RowTombstone.table_name == model.__tablename__,
+        RowTombstone.row_version >= since,
+        RowTombstone.row_id.is_not(None)
+    )}
+
+def find_exported_months(export_dir, months, column, ids):
+    """Those of the exported months whose Parquet file holds any of ids in column"""
+    if not ids:
+        return set()
+    pa = _arrow()
+    import pyarrow.compute as pc
+    value_set = pa.array(sorted(ids), pa.int64())
+    found = set()
+    for month in months:
+        path = os.path.join(partition_dir(export_dir, month), 'part-0.parquet')
+        if not os.path.exists(path):
+            continue
+        values = pa.parquet.read_table(path, columns=[column]).column(column)
+        if pc.any(pc.is_in(values, value_set=value_set)).as_py():
+            found.add(month)
+    return found
+
+def get_changed_months(export_dir, exported, since):
+    """
+    Months to rewrite because transactions since the mark wrote or deleted
+    sales or sale items: the month each changed sale is in now, and the
+    exported month holding each changed or deleted row, which covers sales
+    moved to another month. Found through the row_version indexes, the
+    tombstones and the id columns of the exported files, not by scanning
+    the sales.
+    """
+    changed_items = db.session.query(SaleItem.id, SaleItem.sale_id).filter(SaleItem.row_version >= since).all()
+    changed_sales = {sale_id for sale_id, in db.session.query(SaleTransaction.id).filter(SaleTransaction.row_version >= since)}
+    changed_sales |= {sale_id for _, sale_id in changed_items}
+
+    months = set()
+    if changed_sales:
+        months = {month for month, in db.session.query(sale_month_column()).filter(
+            SaleTransaction.id.in_(changed_sales)
+        ).distinct()}
+    months |= find_exported_months(
+        export_dir, exported, 'sale_id', changed_sales | get_tombstoned_ids(SaleTransaction, since)
+    )
+    months |= find_exported_months(
+        export_dir, exported, 'sale_item_id', {item_id for item_id, _ in changed_items} | get_tombstoned_ids(SaleItem, since)
+    )
+    return months
+
+def load_manifest(export_dir):
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {'partitions': {}}
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+def save_manifest(export_dir, manifest):
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(tmp_path, path)
+
+def partition_dir(export_dir, month):
+    return os.path.join(export_dir, f'sale_month={month}')
+
+def write_partitions(export_dir, months=None):
+    """
+    Stream the fact rows for the given months (all of them by default) from
+    a server-side cursor into one Parquet file per month, built from Arrow
+    record batches. Returns the number of rows written per month; months
+    without sales are left out.
+    """
+    pa = _arrow()
+    schema = get_fact_schema()
+    names = [name for name, _ in FACT_COLUMNS]
+    month = sale_month_column()
+
+    query = db.session.query(
+        month.label('month'),
+        *[column.label(name) for name, column in FACT_COLUMNS]
+    ).select_from(SaleItem
+    ).join(SaleTransaction, SaleItem.sale_id == SaleTransaction.id
+    ).join(Medication, SaleItem.medication_id == Medication.id
+    ).outerjoin(Customer, SaleTransaction.customer_id == Customer.id
+    ).order_by(month, SaleItem.id)
+    if months is not None:
+        query = query.filter(or_(*[
+            and_(SaleTransaction.sale_date >= start, SaleTransaction.sale_date < end)
+            for start, end in map(month_bounds, months)
+        ]))
+
+    row_counts = {}
+    writer = None
+    current_month = None
+    tmp_path = None
+    batch = {name: [] for name in names}
+
+    def flush_batch():
+        if batch['sale_item_id']:
+            writer.write_batch(pa.RecordBatch.from_pydict(batch, schema=schema))
+            for values in batch.values():
+                values.clear()
+
+    def close_partition():
+        flush_batch()
+        writer.close()
+        target_dir = partition_dir(export_dir, current_month)
+        if os.path.isdir(target_dir):
+            shutil.rmtree(target_dir)
+        os.makedirs(target_dir)
+        os.replace(tmp_path, os.path.join(target_dir, 'part-0.parquet'))
+
+    try:
+        for row in stream_rows(query, BATCH_SIZE):
+            if row.month != current_month:
+                if writer is not None:
+                    close_partition()
+                current_month = row.month
+                tmp_path = os.path.join(export_dir, f'.{current_month}.parquet.tmp')
+                writer = pa.parquet.ParquetWriter(tmp_path, schema, compression='snappy')
+                row_counts[current_month] = 0
+
+            for name in names:
+                batch[name].append(getattr(row, name))
+            row_counts[current_month] += 1
+
+            if len(batch['sale_item_id']) >= BATCH_SIZE:
+                flush_batch()
+
+        if writer is not None:
+            close_partition()
+            writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return row_counts
+
+def export_sales_parquet(export_dir, incremental=True):
+    """
+    Write sale_items joined with their transaction, medication and customer
+    as Parquet partitioned by sale month. The manifest keeps the row_version
+    mark of each export; in incremental mode only the months holding sales
+    or items written or deleted since then are rewritten. An export with no
+    usable mark runs in full. Dimension attributes are captured as of the
+    run that wrote a partition; run a full export to refresh them everywhere.
+    """
+    _arrow()
+    os.makedirs(export_dir, exist_ok=True)
+
+    # Taken first: every change the export might miss is stamped this or later
+    mark = db.session.execute(text('SELECT txid_snapshot_xmin(txid_current_snapshot())')).scalar()
+    manifest = load_manifest(export_dir) if incremental else {'partitions': {}}
+    previous = manifest.get('partitions', {})
+    since = manifest.get('mark')
+    if since is None or needs_full_export(since):
+        incremental = False
+
+    if incremental:
+        months = sorted(get_changed_months(export_dir, previous, since))
+        row_counts = write_partitions(export_dir, months) if months else {}
+        removed = [month for month in months if month not in row_counts and month in previous]
+        partitions = {month: info for month, info in previous.items() if month not in removed}
+    else:
+        row_counts = write_partitions(export_dir)
+        removed = sorted(
+            name.split('=', 1)[1] for name in os.listdir(export_dir)
+            if name.startswith('sale_month=') and name.split('=', 1)[1] not in row_counts
+        )
+        partitions = {}
+
+    for month in removed:
+        shutil.rmtree(partition_dir(export_dir, month), ignore_errors=True)
+    for month, rows in row_counts.items():
+        partitions[month] = {'rows': rows}
+
+    save_manifest(export_dir, {
+        'exported_at': datetime.now().isoformat(),
+        'mode': 'incremental' if incremental else 'full',
+        'mark': mark,
+        'partitions': dict(sorted(partitions.items()))
+    })
+
+    return {
+        'written': sorted(row_counts),
+        'removed': removed,
+        'unchanged': len(partitions) - len(row_counts),
+        'rows': sum(row_counts.values())
+    }
+
+def write_export_archive(export_dir, fileobj):
+    """Zip the partition files and manifest into fileobj (Parquet is already compressed)"""
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for root, dirs, files in os.walk(export_dir):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                archive.write(path, os.path.relpath(path, export_dir))
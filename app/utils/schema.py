@@ -0,0 +1,245 @@
+import re
+import time
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from app import db
+from app.utils.live_stats import LIVE_STATS_CHANNEL
+
+# Key of the session advisory lock held while the schema is brought up to
+# date, so workers booting together run the DDL one after another
+SCHEMA_LOCK_KEY = 4821730650
+SCHEMA_LOCK_POLL_SECONDS = 0.5
+
+def ensure_schema():
+    """
+    Create missing tables, and bring existing ones up to date with the
+    models: db.create_all() only creates missing tables, so columns and
+    indexes added to existing tables are created here.
+
+    On Postgres the work is serialized across workers with an advisory
+    lock. Tables, columns and triggers are changed in one short
+    transaction; indexes on existing tables are then built CONCURRENTLY,
+    outside any transaction, so reads and writes carry on meanwhile.
+    """
+    with db.engine.connect() as connection:
+        postgres = connection.dialect.name == 'postgresql'
+        if postgres:
+            # Polled rather than waited for: a concurrent index build waits
+            # out every running statement, including one blocked on the lock
+            while not connection.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': SCHEMA_LOCK_KEY}).scalar():
+                connection.commit()
+                time.sleep(SCHEMA_LOCK_POLL_SECONDS)
+            connection.commit()
+        
+        try:
+            with connection.begin():
+                db.metadata.create_all(connection)
+                add_missing_columns(connection)
+                ensure_change_tracking(connection)
+                ensure_live_stats_notifications(connection)
+            
+            if postgres:
+                connection.execution_options(isolation_level='AUTOCOMMIT')
+            ensure_model_indexes(connection)
+            ensure_trigram_indexes(connection)
+        finally:
+            if postgres:
+                connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': SCHEMA_LOCK_KEY})
+                connection.commit()
+
+def add_missing_columns(connection):
+    inspector = inspect(connection)
+    dialect = connection.dialect
+    ddl_compiler = dialect.ddl_compiler(dialect, None)
+    
+    for table in db.metadata.sorted_tables:
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=dialect)
+            default = ddl_compiler.get_column_default_string(column)
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+            if column.computed is not None:
+                ddl += f' {ddl_compiler.process(column.computed)}'
+            elif default is not None:
+                ddl += f' DEFAULT {default}'
+            connection.execute(text(ddl))
+
+def ensure_model_indexes(connection):
+    if connection.dialect.name != 'postgresql':
+        with connection.begin():
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(bind=connection, checkfirst=True)
+        return
+    
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            ddl = str(CreateIndex(index).compile(dialect=connection.dialect))
+            create_index_concurrently(connection, index.name, ddl)
+
+def create_index_concurrently(connection, index_name, ddl):
+    """
+    Run a CREATE INDEX statement with CONCURRENTLY unless the index exists.
+    Needs a connection in autocommit mode. A concurrent build that was
+    interrupted leaves an invalid index behind, which is dropped and rebuilt.
+    """
+    valid = connection.execute(text("""
+        SELECT i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = :index_name AND c.relnamespace = current_schema()::regnamespace
+    """), {'index_name': index_name}).scalar()
+    if valid:
+        return
+    if valid is False:
+        connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index_name}'))
+    
+    connection.execute(text(re.sub(r'^CREATE (UNIQUE )?INDEX', r'CREATE \1INDEX CONCURRENTLY', ddl.strip())))
+
+# Substring searches use these when pg_trgm is available; without it they
+# fall back to scanning and prefix searches still use their btree indexes.
+# Each indexes the expression the search filters on.
+TRIGRAM_INDEXES = {
+    'ix_customers_name_lower_trgm': ('customers', 'lower(name)'),
+    'ix_customers_phone_digits_trgm': ('customers', 'phone_digits'),
+}
+
+# Trigram indexes on expressions no query filters on any more
+OBSOLETE_INDEXES = ['ix_customers_name_trgm']
+
+def ensure_trigram_indexes(connection):
+    """Needs a connection in autocommit mode, like create_index_concurrently"""
+    if connection.dialect.name != 'postgresql':
+        return
+    
+    extension = connection.execute(text(
+        "SELECT installed_version FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    )).first()
+    if extension is None:
+        return
+    
+    if extension.installed_version is None:
+        try:
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        except Exception:
+            # Creating extensions needs elevated privileges
+            return
+    
+    for index_name, (table_name, expression) in TRIGRAM_INDEXES.items():
+        create_index_concurrently(connection, index_name, (
+            f'CREATE INDEX {index_name} ON {table_name} USING gin (({expression}) gin_trgm_ops)'
+        ))
+    for index_name in OBSOLETE_INDEXES:
+        connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index_name}'))
+
+
+# Tables whose changes incremental backups pick up
+CHANGE_TRACKED_TABLES = ['users', 'medications', 'customers', 'sale_transactions', 'sale_items']
+
+ROW_VERSION_FUNCTION = """
+CREATE OR REPLACE FUNCTION set_row_version() RETURNS trigger AS $$
+BEGIN
+    -- Updates that only touch the columns named in the trigger arguments
+    -- (computed and derived ones) keep the row's version
+    IF TG_OP = 'UPDATE' AND (to_jsonb(NEW) - TG_ARGV) = (to_jsonb(OLD) - TG_ARGV) THEN
+        RETURN NEW;
+    END IF;
+    NEW.row_version := txid_current();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+TOMBSTONE_FUNCTION = """
+CREATE OR REPLACE FUNCTION record_row_tombstone() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        INSERT INTO row_tombstones (table_name, row_id, row_version) VALUES (TG_TABLE_NAME, NULL, txid_current());
+    ELSE
+        INSERT INTO row_tombstones (table_name, row_id, row_version) VALUES (TG_TABLE_NAME, OLD.id, txid_current());
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+def ensure_change_tracking(connection):
+    """
+    Triggers that stamp row_version with the id of the writing transaction
+    on insert and update, and record deletes and truncates in
+    row_tombstones. A backup that notes the oldest transaction still
+    running when it starts can later export just the rows stamped since.
+    """
+    if connection.dialect.name != 'postgresql':
+        return
+    
+    connection.execute(text(ROW_VERSION_FUNCTION))
+    connection.execute(text(TOMBSTONE_FUNCTION))
+    
+    existing = get_triggers(connection)
+    for table_name in CHANGE_TRACKED_TABLES:
+        table = db.metadata.tables[table_name]
+        ignored = [
+            column.name for column in table.columns
+            if column.computed is not None or column.info.get('derived') or column.name == 'row_version'
+        ]
+        ensure_trigger(connection, existing, f'{table_name}_row_version', table_name,
+                       'BEFORE INSERT OR UPDATE', 'ROW', 'set_row_version', ignored)
+        ensure_trigger(connection, existing, f'{table_name}_delete_tombstone', table_name,
+                       'AFTER DELETE', 'ROW', 'record_row_tombstone')
+        ensure_trigger(connection, existing, f'{table_name}_truncate_tombstone', table_name,
+                       'AFTER TRUNCATE', 'STATEMENT', 'record_row_tombstone')
+
+def get_triggers(connection):
+    """Function name and arguments of each trigger the app defines, by trigger name"""
+    rows = connection.execute(text(
+        'SELECT t.tgname, p.proname, t.tgnargs, t.tgargs FROM pg_trigger t '
+        'JOIN pg_proc p ON p.oid = t.tgfoid WHERE NOT t.tgisinternal'
+    ))
+    # tgargs holds each argument followed by a zero byte
+    return {
+        name: (function, tuple(bytes(args).decode().split('\0')[:argument_count]))
+        for name, function, argument_count, args in rows
+    }
+
+def ensure_trigger(connection, existing, trigger_name, table_name, events, level, function, arguments=()):
+    """
+    Create a trigger, or drop and recreate it when it exists but calls a
+    different function or with different arguments, e.g. after a column
+    is marked derived. existing is get_triggers(connection).
+    """
+    if existing.get(trigger_name) == (function, tuple(arguments)):
+        return
+    argument_list = ', '.join(f"'{argument}'" for argument in arguments)
+    connection.execute(text(f'DROP TRIGGER IF EXISTS {trigger_name} ON {table_name}'))
+    connection.execute(text(
+        f'CREATE TRIGGER {trigger_name} {events} ON {table_name} '
+        f'FOR EACH {level} EXECUTE FUNCTION {function}({argument_list})'
+    ))
+
+
+# Tables whose commits change the dashboard figures pushed to live streams
+LIVE_STATS_TABLES = ['medications', 'sale_transactions', 'sale_items']
+
+LIVE_STATS_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION notify_live_stats() RETURNS trigger AS $$
+BEGIN
+    -- Delivered at commit, once per transaction however many statements fire it
+    PERFORM pg_notify('{LIVE_STATS_CHANNEL}', '');
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+def ensure_live_stats_notifications(connection):
+    """Statement triggers that wake every worker's live stats listener, see LiveStatsPublisher"""
+    if connection.dialect.name != 'postgresql':
+        return
+    
+    connection.execute(text(LIVE_STATS_FUNCTION))
+    existing = get_triggers(connection)
+    for table_name in LIVE_STATS_TABLES:
+        ensure_trigger(connection, existing, f'{table_name}_live_stats', table_name,
+                       'AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE', 'STATEMENT', 'notify_live_stats')
@@ -0,0 +1,16 @@
+from app.utils.backup import copy_value
+
+def test_null_is_copy_null_marker():
+    assert copy_value(None) == '\\N'
+
+def test_special_characters_are_escaped():
+    assert copy_value('a\\b') == 'a\\\\b'
+    assert copy_value('a\tb\nc\rd') == 'a\\tb\\nc\\rd'
+
+def test_backslash_is_escaped_before_control_characters():
+    assert copy_value('\\\n') == '\\\\\\n'
+
+def test_other_values_are_text():
+    assert copy_value(12.5) == '12.5'
+    assert copy_value(True) == 'True'
+    assert copy_value('plain') == 'plain'
@@ -0,0 +1,72 @@
+import threading
+import time
+import pytest
+from app.utils.cache import TTLCache
+
+def test_concurrent_callers_share_one_computation():
+    cache = TTLCache()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(timeout=5)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('key', compute, 60))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert len(calls) == 1
+    assert results == ['value'] * 5
+
+def test_waiting_callers_see_the_leaders_error():
+    cache = TTLCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(timeout=5)
+        raise ValueError('failed')
+
+    errors = []
+    def call():
+        try:
+            cache.get_or_compute('key', compute, 60)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(timeout=5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    time.sleep(0.1)
+    release.set()
+    leader.join(timeout=5)
+    follower.join(timeout=5)
+
+    assert len(errors) == 2
+
+def test_entries_expire_and_can_be_invalidated():
+    cache = TTLCache()
+    values = iter(range(10))
+
+    assert cache.get_or_compute('key', lambda: next(values), 60) == 0
+    assert cache.get_or_compute('key', lambda: next(values), 60) == 0
+    cache.invalidate('key')
+    assert cache.get_or_compute('key', lambda: next(values), 0) == 1
+    assert cache.get_or_compute('key', lambda: next(values), 60) == 2
+
+def test_failed_computation_is_not_cached():
+    cache = TTLCache()
+
+    with pytest.raises(ZeroDivisionError):
+        cache.get_or_compute('key', lambda: 1 / 0, 60)
+    assert cache.get_or_compute('key', lambda: 'value', 60) == 'value'
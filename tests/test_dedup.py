@@ -0,0 +1,40 @@
+from app.utils.dedup import soundex, normalize_name, score_pair
+
+def customer(name, phone=None, email=None):
+    return {'name': normalize_name(name), 'phone': phone, 'email': email}
+
+def test_soundex_codes():
+    assert soundex('smith') == soundex('smyth') == 's530'
+    assert soundex('robert') == 'r163'
+    assert soundex('tymczak') == 't522'
+    assert soundex('pfister') == 'p236'
+    assert soundex('') == ''
+
+def test_soundex_h_and_w_do_not_separate_same_codes():
+    assert soundex('ashcraft') == 'a261'
+
+def test_normalize_name_ignores_accents_case_and_word_order():
+    assert normalize_name('María  LOPEZ') == normalize_name('lopez, maria') == 'lopez maria'
+
+def test_identical_names_alone_reach_the_default_score():
+    score, reasons = score_pair(customer('Maria Lopez'), customer('lopez maria'))
+
+    assert score == 0.6
+    assert reasons == ['same name']
+
+def test_shared_phone_adds_to_name_similarity():
+    score, reasons = score_pair(customer('Jon Smith', '555123456'), customer('John Smith', '555123456'))
+
+    assert score > 0.7
+    assert 'same phone' in reasons
+
+def test_conflicting_phone_keeps_identical_names_below_default():
+    score, reasons = score_pair(customer('Maria Lopez', '555123456'), customer('Maria Lopez', '555999000'))
+
+    assert score < 0.6
+    assert 'different phone' in reasons
+
+def test_pairs_that_cannot_reach_min_score_score_zero():
+    score, _ = score_pair(customer('Anna Berg'), customer('Peter Olsen'), min_score=0.6)
+
+    assert score == 0
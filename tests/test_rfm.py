@@ -0,0 +1,19 @@
+import numpy as np
+from app.utils.analytics import quantile_scores
+
+def test_heavily_tied_values_score_from_the_bottom_of_the_tie():
+    frequencies = np.array([1] * 70 + [2] * 20 + [3] * 7 + [10] * 3)
+    scores = quantile_scores(frequencies)
+
+    assert set(scores[frequencies == 1]) == {1}
+    assert set(scores[frequencies == 2]) == {4}
+    assert set(scores[frequencies == 3]) == {5}
+    assert set(scores[frequencies == 10]) == {5}
+
+def test_distinct_values_spread_over_all_scores():
+    scores = quantile_scores(np.arange(10))
+
+    assert scores.tolist() == [1, 1, 2, 2, 3, 3, 4, 4, 5, 5]
+
+def test_single_value_scores_top():
+    assert quantile_scores(np.array([42.0])).tolist() == [5]
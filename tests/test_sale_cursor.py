@@ -0,0 +1,17 @@
+from datetime import datetime
+from types import SimpleNamespace
+from app.utils.helpers import format_sale_cursor, parse_sale_cursor
+
+def test_cursor_round_trip():
+    sale = SimpleNamespace(sale_date=datetime(2024, 3, 5, 14, 30, 15, 123456), id=42)
+
+    assert parse_sale_cursor(format_sale_cursor(sale)) == (sale.sale_date, 42)
+
+def test_missing_cursor():
+    assert parse_sale_cursor(None) is None
+    assert parse_sale_cursor('') is None
+
+def test_malformed_cursors():
+    assert parse_sale_cursor('garbage') is None
+    assert parse_sale_cursor('2024-03-05T14:30:15_abc') is None
+    assert parse_sale_cursor('not-a-date_42') is None
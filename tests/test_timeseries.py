@@ -0,0 +1,20 @@
+from datetime import date
+from app.utils.analytics import choose_timeseries_bucket
+
+def test_auto_picks_the_finest_bucket_that_fits():
+    assert choose_timeseries_bucket(date(2024, 1, 1), date(2024, 1, 3)) == 'hour'
+    assert choose_timeseries_bucket(date(2024, 1, 1), date(2024, 3, 31)) == 'day'
+    assert choose_timeseries_bucket(date(2024, 1, 1), date(2025, 12, 31)) == 'week'
+
+def test_requested_bucket_is_kept_when_it_fits():
+    assert choose_timeseries_bucket(date(2024, 1, 1), date(2024, 1, 31), 'week') == 'week'
+
+def test_too_fine_bucket_is_coarsened():
+    assert choose_timeseries_bucket(date(2024, 1, 1), date(2024, 1, 31), 'hour') == 'day'
+    assert choose_timeseries_bucket(date(2024, 1, 1), date(2025, 12, 31), 'day', max_points=50) == 'month'
+
+def test_unknown_bucket_is_treated_as_auto():
+    assert choose_timeseries_bucket(date(2024, 1, 1), date(2024, 1, 1), 'decade') == 'hour'
+
+def test_coarsest_bucket_when_nothing_fits():
+    assert choose_timeseries_bucket(date(2000, 1, 1), date(2024, 12, 31), max_points=10) == 'month'